@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+'''Compare the old string built LIKE queries with flux_db.NodeStatusDb on a large SQLite table
+
+usage: bench_db.py [nodes] [samples per node]
+'''
+import os
+import sys
+import tempfile
+import time
+from flux_db import NodeStatusDb, sqlite_init
+
+def fill(store, nodes, samples):
+    '''Insert samples rows for each of nodes fake nodes'''
+    rows = []
+    for sample in range(samples):
+        for node in range(nodes):
+            health = 100 if (node + sample) % 7 else 0
+            state = "CONFIRMED" if health else "noapiport"
+            rows.append(("COutPoint(%064x, 0)" % node, "10.%d.%d.1" % (node // 250, node % 250), state, health, "bench"))
+        if len(rows) > 50000:
+            store.insert(rows)
+            rows = []
+    store.insert(rows)
+
+def old_queries(db, hashes):
+    '''Per node detail query as examine_db built it before NodeStatusDb'''
+    for node_hash in hashes:
+        DETAILS = "SELECT `node_state`, `node_comment`, `node_ip` from `node_status` WHERE `node_hash` LIKE '" + node_hash + "' ORDER BY `node_status`.`time` ASC"
+        cur = db.cursor()
+        cur.execute(DETAILS)
+        cur.fetchall()
+
+def new_queries(store, hashes):
+    for node_hash in hashes:
+        store.states(node_hash)
+
+if __name__ == "__main__":
+    num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_samples = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with tempfile.TemporaryDirectory() as tmp:
+        bench = NodeStatusDb(sqlite_init(os.path.join(tmp, "bench.db")))
+        fill(bench, num_nodes, num_samples)
+        node_hashes = [row[2] for row in bench.summary()]
+        start = time.perf_counter()
+        old_queries(bench.db, node_hashes)
+        old_time = time.perf_counter() - start
+        start = time.perf_counter()
+        new_queries(bench, node_hashes)
+        new_time = time.perf_counter() - start
+        print("%d nodes x %d samples" % (num_nodes, num_samples))
+        print("LIKE, new cursor per query   %8.3f s" % old_time)
+        print("= with reused cursor         %8.3f s" % new_time)
+        print("speedup                      %8.1f x" % (old_time / new_time))
+        bench.close()
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+'''Peak RSS of a --all sweep over a simulated network as it grows 10x
+
+usage: bench_memory.py [nodes] [workers]
+
+get_node_list, get_flux and probe_port are replaced by fakes returning
+payloads shaped like the real API, and the sink is slower than the probes,
+as a database on a busy disk is. Each size is run in a fresh process with
+the bounded pipeline (--max-in-flight default) and with every node
+submitted at once, which is what pool.map did.
+'''
+import os
+import resource
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def fake_nodes(count):
+    return [{'collateral': "COutPoint(%064x, 0)" % i, 'ip': "10.%d.%d.%d:16127" % (i // 62500, i // 250 % 250, i % 250 + 1),
+        'txhash': "%064x" % i, 'outidx': "0", 'tier': "CUMULUS", 'payment_address': "t1" + "x" * 33,
+        'pubkey': "%066x" % i, 'activesince': "1690000000", 'lastpaid': "1690000000", 'rank': i} for i in range(count)]
+
+def fake_flux(the_node, path):
+    if path == "daemon/getzelnodestatus":
+        return {'status': "CONFIRMED", 'tier': "CUMULUS"}
+    if path == "apps/listrunningapps":
+        return [{'Names': ["/flux%d_app%d" % (i, i)], 'State': "running", 'Status': "Up 3 days",
+            'Image': "runonflux/app%d:latest" % i, 'Command': "x" * 200, 'Labels': {'label%d' % j: "y" * 40 for j in range(20)},
+            'Ports': [{'IP': "0.0.0.0", 'Type': "tcp", 'PublicPort': 30000 + i, 'PrivatePort': 80}]} for i in range(20)]
+    return []
+
+class SlowSink:
+    def add(self, *row):
+        time.sleep(0.00005)
+
+    def pending(self):
+        return 0
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+def child(count, workers, bounded):
+    import flux_scan
+    flux_scan.get_node_list = lambda filter: fake_nodes(count)
+    flux_scan.get_flux = fake_flux
+    flux_scan.probe_port = lambda node_ip, port: ("OK", 1)
+    flux_scan.max_in_flight = 0 if bounded else count
+    sys.stdout = open(os.devnull, "w")
+    flux_scan.check_nodes("", SlowSink(), workers)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+def peak_mb(count, workers, bounded):
+    out = subprocess.run([sys.executable, __file__, "--child", str(count), str(workers), str(int(bounded))],
+        cwd=HERE, capture_output=True, text=True, check=True).stderr
+    return int(out.split()[-1])
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        print(child(int(sys.argv[2]), int(sys.argv[3]), sys.argv[4] == "1"), file=sys.stderr)
+        sys.exit(0)
+    num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    num_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    print("%8s %14s %14s" % ("nodes", "bounded MB", "unbounded MB"))
+    for size in (num_nodes, num_nodes * 10):
+        print("%8d %14d %14d" % (size, peak_mb(size, num_workers, True), peak_mb(size, num_workers, False)))
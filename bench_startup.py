@@ -0,0 +1,39 @@
+#!/usr/bin/python3
+'''Measure how long the CLIs take to start for quick commands
+
+usage: bench_startup.py [runs]
+
+Each command is started runs times, the median wall time is printed next to
+a bare interpreter start for comparison.
+'''
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def time_command(args, runs):
+    '''Median milliseconds to run args to completion'''
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, cwd=HERE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "bench.db")
+        commands = (
+            ("python3 -c pass", [sys.executable, "-c", "pass"]),
+            ("check_nodes.py (usage)", [sys.executable, "check_nodes.py"]),
+            ("check_nodes_sql.py (usage)", [sys.executable, "check_nodes_sql.py"]),
+            ("check_nodes_sql.py --sqlite --examine", [sys.executable, "check_nodes_sql.py", "--sqlite", db_name, "--examine"]),
+            ("p1_agent.py --dump", [sys.executable, "p1_agent.py", "--dump"]),
+        )
+        for name, args in commands:
+            print("%-40s %7.1f ms" % (name, time_command(args, count)))
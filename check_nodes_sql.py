@@ -1,20 +1,9 @@
 #!/usr/bin/python3
-'''This module is a single file that supports the loading of secrets into a Flux Node'''
-from asyncio import open_connection
-import json
+'''Check Flux nodes and store the results in MySQL, then report on node health'''
 import sys
-import requests
-import socket
-from datetime import datetime
-import time
 import signal
-import mysql.connector
-import os
-
-max_nodes = 0
-num_nodes = 0
-num_checked = 0
-num_good = 0
+from datetime import datetime, timedelta
+from flux_options import option_from_argv, reject_for_app
 
 summary_header = '''
 Perfect - All samples scores 100%
@@ -30,477 +19,226 @@ nonroutablepeer - Found non-routable IP address in peer list (10.x, 192.168.x et
 incomingfailed -  Get flux/incomingconnections failed
 nonroutableincoming - Found non-Routable IP in incoming connections
 nolistapps -      Get apps/listrunningapps failed
+checkerror -      The node's replies could not be checked (see the scan log)
 
 '''
-def include(filename):
-    if os.path.exists(filename): 
-        os.execfile(filename)
-
-def handler(signum, frame):
-    print("Checked ", num_checked, " of ", num_nodes, "/", max_nodes, " and ", num_good, " had no errors")
-    msg = "Ctrl-c was pressed. Do you really want to exit? y/n "
-    print(msg, end="", flush=True)
-    res = sys.stdin.read(1)
-    if res == 'y':
-        print("")
-        raise signal.SIGTERM
-        exit(1)
-    else:
-        print("", end="\r", flush=True)
-        print(" " * len(msg), end="", flush=True) # clear the printed line
-        print("    ", end="\r", flush=True)
- 
-def timestamp():
-    cur_time = datetime.now()
-    now = cur_time.strftime("%Y-%m-%d %H:%M:%S ")
-    return now
-
-def logmsg(msg):
-    '''Format message with date and time'''
-    return timestamp()+msg
-
-def print_log(node_ip, mylog):
-    '''Print log for a node'''
-    print(" ")
-    print(node_ip, "Min", mylog['min'], "Max", mylog['max'], "Avg", mylog['avg'])
-    for line in mylog['log']:
-        print(line)
-
-def get_public_ip():
-    '''Get public ip or return None'''
-    url = "http://ifconfig.me/ip"
-    req = requests.get(url)
-    pub_ip = None
-    if req.status_code == 200:
-        pub_ip = req.text
-    return pub_ip
-
-def non_routable_ip(ip_adr):
-    '''Check IPv4 or IPv6 Encoded IPv4 address for Private IPs'''
-    ipadr = ip_adr
-    if ipadr.startswith("::ffff:"):
-        ipadr = ipadr[7:]
-    bytes = ipadr.split(".")
-    a = int(bytes[0])
-    b = int(bytes[1])
-    if a == 10:
-        return True
-    if a == 192 and b == 168:
-        return True
-    if a == 172 and b >= 16 and b <= 31:
-        return True
-    if a == 169 and b == 254:
-        # Link Local does not make sense in a networkin environment
-        return True
-    return False
+def window_start(since=None, window=None):
+    '''Start time for a report from --since "YYYY-MM-DD[ HH:MM[:SS]]" or --window 90m/24h/7d'''
+    if since is not None:
+        for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+            try:
+                return datetime.strptime(since, fmt)
+            except ValueError:
+                pass
+        raise ValueError("--since must look like YYYY-MM-DD or 'YYYY-MM-DD HH:MM'")
+    if window is not None:
+        units = {'m': 60, 'h': 3600, 'd': 86400}
+        if len(window) < 2 or window[-1] not in units:
+            raise ValueError("--window must be a number followed by m, h or d")
+        start = datetime.now() - timedelta(seconds=float(window[:-1]) * units[window[-1]])
+        return start.replace(microsecond=0)
+    return None
+
+def prune_db(store, days):
+    '''Roll samples older than days up into node_status_daily, then delete them'''
+    cutoff = (datetime.now() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+    days_rolled, samples = store.prune(cutoff)
+    print("Rolled up ", days_rolled, " node days and removed ", samples, " samples before ", cutoff)
+    store.close()
+
+def fix_db(store):
+    '''Fill in node_hash for old records that only have the node IP'''
+    from flux_scan import get_node_list
+    nodes = get_node_list("")
+    if nodes is not None:
+        updates = 0
+        for this_node in nodes:
+            updates = updates + store.set_hash(this_node["collateral"], this_node["ip"])
+        store.commit()
+        print("Updated ", updates, " records")
+    store.close()
+
+def node_details(store, node_hash, since=None):
+    '''Print every sample recorded for one node'''
+    print(node_hash)
+    for row in store.details(node_hash, since):
+        print(row[1].strftime("%m/%d/%Y, %H:%M:%S"), row[4], row[5], row[6])
 
-def get_node_ip_or_local(the_node):
-    include("local_nodes.py")
-    if the_node in local_nodes:
-        the_node = local_nodes[the_node]
-    node_ip = the_node.split(":")[0]
-    return node_ip
+def examine_db(store, since=None):
+    '''Examine the db to find nodes that are failing, only samples after since if given'''
+    from flux_health import HealthReport
+    report = HealthReport().add_all(store.samples(since))
+    print(summary_header)
+    report.show()
+    store.close()
+
+def export_parquet(store, directory):
+    '''Copy the node_status history to day partitioned Parquet files'''
+    from flux_sinks import ParquetSink
+    sink = ParquetSink(directory)
+    rows = 0
+    for row in store.export():
+        sink.add_row(row[0], row[1], row[2], row[3], row[4], comment=row[5])
+        rows = rows + 1
+    sink.close()
+    print("Exported ", rows, " records to ", directory)
+    store.close()
+
+USAGE = (
+    "--mysql host-ip-dns username passwd dbname - must be first if present",
+    "--sqlite path - use a local SQLite db instead of MySQL, must be first if present",
+    "--examine summarize node health stored in the db",
+    "--details node_hash - list every sample stored for a node",
+    "--since 'YYYY-MM-DD HH:MM' or --window 24h/7d - limit --examine and --details to recent samples",
+    "--prune days - roll samples older than days up into node_status_daily and delete them",
+    "--fix    fill in missing node hashes in the db",
+    "--export-parquet dir - copy the db history to Parquet files partitioned by day",
+    "--all    check all nodes for running applications to test",
+    "--filter check nodes matching the supplied `filter` for running applications to test",
+    "--app    test nodes running application 'app'",
+    "--workers N - check N nodes (or app instances/ports) at a time",
+    "--max-in-flight N - nodes being checked or waiting to be saved at once (default 2 x workers)",
+    "--shard i/N - only check slice i (0..N-1) of the node list, --shards N runs N such processes",
+    "--rate N, --host-rate N - limit calls per second overall and per node (default 50/5 with --workers),",
+    "         --shards splits the --rate budget between its workers",
+    "--csv name, --jsonl name (- for stdout), --parquet dir or --stdout - also save results there",
+    "--flush-interval secs - how often buffered CSV rows are written (default 5)",
+    "--events name (- for stdout), --webhook url - report node and port state changes as they happen",
+    "--health - print the --examine summary for the nodes just checked",
+    "--progress - status line with nodes/s, ETA and failures, --progress-port N - same as JSON on localhost:N",
+    "--cache  or --cache-file name - reuse recent API results (saved to 'name')",
+    "--record name - save every API answer and port probe of the run to 'name', --replay name - rerun from it",
+    "--profile name - sample where the run spends its time, collapsed stacks for a flamegraph go to 'name'",
+)
+
+def usage():
+    print("Incorrect arguments:")
+    for line in USAGE:
+        print(sys.argv[0], line)
+    sys.exit(1)
 
-def get_flux(the_node, path):
-    '''Call flux API'''
-    include("local_nodes.py")
-    if len(the_node) == 0:
-        the_node = "api.runonflux.io"
-    else:
-        if len(the_node.split(":")) == 1:
-            the_node = the_node + ":16127"
-    if the_node in local_nodes:
-        the_node = local_nodes[the_node]
-    url = "http://" + the_node + "/" + path
+def open_db(argv):
+    '''Remove --mysql host user passwd db or --sqlite path (first argument) from argv, return a NodeStatusDb or None'''
+    if len(argv) > 5 and argv[1].lower() == "--mysql":
+        from flux_db import NodeStatusDb, mysql_init
+        store = NodeStatusDb(mysql_init(argv[2], argv[3], argv[4], argv[5]))
+        del argv[1:6]
+        return store
+    if len(argv) > 2 and argv[1].lower() == "--sqlite":
+        from flux_db import NodeStatusDb, sqlite_init
+        store = NodeStatusDb(sqlite_init(argv[2]))
+        del argv[1:3]
+        return store
+    return None
+
+def run_examine(store, value, argv):
+    examine_db(store, since_from_argv(argv))
+
+def run_details(store, value, argv):
+    node_details(store, value, since_from_argv(argv))
+    store.close()
+
+def run_prune(store, value, argv):
     try:
-        req = requests.get(url, timeout=5)
-    except KeyboardInterrupt:
-        raise KeyboardInterrupt
-    except:
-        return None
-    # Get the list of nodes where our app is deplolyed
-    ret_data = None
-    if req.status_code == 200:
-        try:
-            values = json.loads(req.text)
-            if values["status"] == "success":
-                # json looks good and status correct, iterate through node list
-                ret_data = values["data"]
-        except ValueError:
-            ret_data = None
-    return ret_data
-
-def node_connection(port, appip):
-    '''Open socket to Node'''
+        days = int(value)
+    except ValueError:
+        days = -1
+    if days < 0:
+        print("--prune needs a number of days, 0 or more")
+        store.close()
+        sys.exit(1)
+    prune_db(store, days)
+
+def run_export(store, value, argv):
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    except socket.error:
-        return 'Failed to create socket'
-
+        export_parquet(store, value)
+    except RuntimeError as error:
+        print(error)
+        sys.exit(1)
+
+def run_fix(store, value, argv):
+    fix_db(store)
+
+def run_scan(store, value, argv, command):
+    '''--all, --filter value or --app value, the scanner is only imported here'''
+    if command == "--app":
+        reject_for_app(argv)
+    import flux_scan
+    from flux_sinks import DbSink, make_sink
+    shard = flux_scan.shard_from_argv(argv)
+    health = "--health" in argv
+    if health:
+        argv.remove("--health")
+    signal.signal(signal.SIGINT, flux_scan.handler)
+    sinks, workers = flux_scan.setup_from_argv(argv)
+    if command == "--app":
+        flux_scan.check_app(value, workers)
+        return
     try:
-        remote_ip = socket.gethostbyname( appip )
-    except socket.gaierror:
-        return 'Hostname could not be resolved'
-
-    # Set short timeout
-    sock.settimeout(30)
-
-    # Connect to remote server
+        from flux_events import events_from_argv
+        events = events_from_argv(argv, store)
+    except OSError as error:
+        print("Open of ", error.filename, " failed")
+        sys.exit(1)
+    if events is not None:
+        # Ahead of DbSink, which closes the store
+        sinks.insert(0, events)
+    if store is not None:
+        sinks.append(DbSink(store))
+    if health:
+        from flux_health import HealthSink
+        sinks.append(HealthSink())
+    flux_scan.check_nodes(value, make_sink(sinks), workers, shard)
+
+def since_from_argv(argv):
+    '''Report start time from --since / --window, exits on a bad value'''
     try:
-        error = None
-        #  print('# Connecting to server, ' + appip + ' (' + remote_ip + ')')
-        sock.connect((remote_ip , port))
-    except ConnectionRefusedError:
-        error = "Refused"
-        sock.close()
-        sock = None
-    except TimeoutError:
-        error = "TimeoutError"
-        sock.close()
-        sock = None
-    except socket.error:
-        error = "NoRoute"
-        sock.close()
-        sock = None
-
-    if sock is None:
-        return error
-
-    sock.settimeout(None)
-    # Set longer timeout
-    sock.settimeout(60)
-    return sock
-
-def check_app(app_name):
-    '''Check all running instances and see if we can reach the app'''
-    url = "https://api.runonflux.io/apps/location/" + app_name
-    req = requests.get(url, timeout=10)
-    # Get the list of nodes where our app is deplolyed
-    if req.status_code == 200:
-        values = json.loads(req.text)
-        if values["status"] == "success":
-            # json looks good and status correct, iterate through node list
-            nodes = values["data"]
-
-            for this_node in nodes:
-                data = get_flux(this_node['ip'], "daemon/getzelnodestatus")
-                #print(data)
-                status = data['status']
-                if status == "CONFIRMED":
-                    tier = data['tier']
-                else:
-                    tier = "none"
-                print(this_node['ip'] + " " + status + " " + tier)
-                data = get_flux(this_node['ip'], "apps/listrunningapps")
-                for app in data:
-                    app_state = ""
-                    if app["Names"][0].startswith("/flux") and app["Names"][0].endswith("_" + name):
-                        app_state += app["Names"][0]
-                        app_state += " State " + app["State"] + " Status " + app["Status"] + " "
-                        ports = app["Ports"]
-                        for port in ports:
-                            if "IP" in port and port["IP"] == "0.0.0.0" and port["Type"] == "tcp":
-                                app_state += str(port["PublicPort"]) + " "
-                                node_ip = this_node['ip'].split(":")[0]
-                                sock = node_connection(port["PublicPort"], node_ip)
-                                if isinstance(sock, str):
-                                    app_state += sock + " "
-                                else:
-                                    app_state += "OK "
-                                    sock.close()
-                        print(" App: " + app_state)
-
-# CSV Format
-# Timestamp, NodeIP, Status (CONFIRMED, expired, noapiport), Tier, App, port, status
-def add_db(db, node, node_ip, nstatus, health, status):
-    ADD_NODE_STATUS = ("INSERT INTO node_status (node_hash, node_ip, node_state, node_health, node_comment) VALUES ( %s, %s, %s, %s, %s)")
-    ADD_NODE_VALUES = (str(node), node_ip, nstatus, health, status)
-    if db is not None:
-        cursorObject = db.cursor()
-        cursorObject.execute(ADD_NODE_STATUS, ADD_NODE_VALUES)
-        db.commit()
-        #print("MYSQL", ADD_NODE_STATUS, ADD_NODE_VALUES)
-
-def fix_db(db):
-    '''Check all running instances and see if we can reach the app'''
-    url = "https://api.runonflux.io/daemon/viewdeterministiczelnodelist/"
-    req = requests.get(url)
-    # Get the list of nodes where our app is deployed
-    SET_HASH = "UPDATE `node_status` SET `node_hash`= %s WHERE `node_ip`= %s AND `node_hash` IS NULL"
-    if req.status_code == 200:
-        values = json.loads(req.text)
-        if values["status"] == "success":
-            # json looks good and status correct, iterate through node list
-            nodes = values["data"]
-            updates = 0
-            for this_node in nodes:
-                sys.stdout.flush()
-                cursorObject = db.cursor()
-                cursorObject.execute(SET_HASH, (this_node["collateral"], this_node["ip"]))
-                db.commit()
-                updates = updates + cursorObject.rowcount
-            print("Updated ", updates, " records")
-    db.close()
-
-def node_details(db, node):
-    print(node)
-    DETAILS = "SELECT * from `node_status` WHERE `node_hash` LIKE '" + node[2] + "' ORDER BY `node_status`.`time` ASC"
-    #print(DETAILS)
-    cur = db.cursor()
-    cur.execute(DETAILS)
-    list = cur.fetchall()
-    for row in list:
-        print(row[1].strftime("%m/%d/%Y, %H:%M:%S"), row[4], row[5], row[6])
-
-def examine_db(db):
-    '''Examine the db to find nodes that are failing'''
-    SUMMARY = "SELECT count(*) as count, sum(`node_health`) as health,`node_hash`,`node_ip` FROM `node_status`" + \
-        " WHERE 1 GROUP BY `node_hash` ORDER BY count(*)  DESC"
-    cur = db.cursor()
-    cur.execute(SUMMARY)
-    nodes = cur.fetchall()
-    summary = {}
-    summary["expired"] = []
-    summary["Mixed"] = []
-    summary["Healed"] = []
-    young_healthy = 0
-    young_good = 0
-    for node in nodes:
-        count = int(node[0])
-        health = int(str(node[1]))
-        avg = health / count
-        node_summary = {}
-        last_state = "CONFIRMED"
-        last_ip = "unknown"
-        if count < 3:
-            node_summary["Young"] = 1
-            if avg > 99.0:
-                young_healthy = young_healthy + 1
-            else:
-                if avg > 80.0:
-                    young_good = young_good + 1
-            # DETAILS = "SELECT * from `node_status` WHERE `node_hash` LIKE '" + node[2] + "' ORDER BY `node_status`.`time` ASC"
-            # cur = db.cursor()
-            # cur.execute(DETAILS)
-            # list = cur.fetchall()
-            # for row in list:
-            #     print(row)
-        else:
-            if avg < 99.0:
-                DETAILS = "SELECT `node_state`, `node_comment`, `node_ip` from `node_status` WHERE `node_hash` LIKE '" + node[2] + "' ORDER BY `node_status`.`time` ASC"
-                cur = db.cursor()
-                cur.execute(DETAILS)
-                list = cur.fetchall()
-                for row in list:
-                    if row[0] not in node_summary:
-                        node_summary[row[0]] = 0
-                    node_summary[row[0]] = node_summary[row[0]] + 1
-                    last_state = row[0] # For unstable nodes to be good the current state must be CONFIRMED, grab IP
-                    last_ip = row[2]
-            else:
-                node_summary["Perfect"] = 1
-        if len(node_summary) == 1:
-            for key in node_summary:
-                if key not in summary:
-                    summary[key] = [node[2]]
-                else:
-                    summary[key].append(node[2])
-        else:
-            max = 0
-            sum = 0
-            name = ""
-            for ns in node_summary:
-                if node_summary[ns] > max:
-                    max = node_summary[ns] # Find most common state (is it CONFIRMED?)
-                    name = ns
-                sum = sum + node_summary[ns]
-            if last_state == "expired":
-                summary["expired"].append([node[2], node_summary])
-            else:
-                if last_state == "CONFIRMED" and name == "CONFIRMED" and sum/len(node_summary) > 0.80:
-                    summary["Healed"].append([node[2], node_summary])
-                else:
-                    summary["Mixed"].append([node[2], last_ip, node_summary])
-    print(summary_header)
-    for line in summary:
-        if line != "Mixed":
-            if line == "Young":
-                print("%6d Young (%d appear healthy)" % (len(summary[line]), young_healthy))
-            else:
-                print("%6d %s" % (len(summary[line]), line))
-    print("%6d Mixed Results" % (len(summary["Mixed"])))
-    for mixed in summary["Mixed"]:
-        print(mixed[0], mixed[1], mixed[2])
-    db.close()
-
-def check_nodes(filter, db):
-    '''Check all running instances and see if we can reach the app'''
-    global max_nodes, num_checked, num_good, num_nodes
-    url = "https://api.runonflux.io/daemon/viewdeterministiczelnodelist/" + filter
-    req = requests.get(url)
-    # Get the list of nodes where our app is deployed
-    if req.status_code == 200:
-        values = json.loads(req.text)
-        if values["status"] == "success":
-            # json looks good and status correct, iterate through node list
-            nodes = values["data"]
-            max_nodes = len(nodes)
-            num_nodes = 0
-            num_checked = 0
-            num_good = 0
-            for this_node in nodes:
-                sys.stdout.flush()
-                num_nodes += 1
-                data = get_flux(this_node['ip'], "daemon/getzelnodestatus")
-                #print("Node Status:", data)
-                if data is None:
-                    print(logmsg(this_node["ip"] + " API Port FAILED"))
-                    add_db(db, this_node["collateral"], this_node["ip"], "noapiport", 0, "API Port unreachable")
-                    continue
-                status = data['status']
-                if status == "CONFIRMED":
-                    tier = data['tier']
-                else:
-                    tier = "none"
-                data = get_flux(this_node['ip'], "flux/connectedpeers")
-                if data is None:
-                    print(logmsg(this_node["ip"] + " " + status + " " + tier + " FAILED get connected peers"))
-                    add_db(db, this_node["collateral"], this_node["ip"], "getpeersfailed", 10, tier + "API Port usable but request failed")
-                    continue
-                for peer in data:
-                    failed = False
-                    if non_routable_ip(peer):
-                        print(logmsg(this_node["ip"] + " " + status + " " + tier + " non routable peer " + peer))
-                        add_db(db, this_node["collateral"], this_node["ip"], "nonroutablepeer", 20, tier + " Found a peer with Private IP")
-                        failed = True
-                        break
-                if failed:
-                    continue
-                data = get_flux(this_node['ip'], "flux/incomingconnections")
-                if data is None:
-                    print(logmsg(this_node["ip"] + " " + status + " " + tier + " FAILED get incoming connection"))
-                    add_db(db, this_node["collateral"], this_node["ip"], "incomingfailed", 21, tier + " API Port usable but request failed")
-                    continue
-                for peer in data:
-                    failed = False
-                    if non_routable_ip(peer):
-                        print(logmsg(this_node["ip"] + " " + status + " " + tier + " non routable incoming " + peer))
-                        add_db(db, this_node["collateral"], this_node["ip"], "nonroutableincoming", 22, tier + " Found incoming connection with Private IP")
-                        failed = True
-                        break
-                if failed:
-                    continue
-                data = get_flux(this_node['ip'], "apps/listrunningapps")
-                if data is None:
-                    print(logmsg(this_node["ip"] + " " + status + " " + tier + " FAILED get running apps"))
-                    add_db(db, this_node["collateral"], this_node["ip"], "nolistapps", 50, tier + " App list returned NONE - Error?")
-                    continue
-                for app in data:
-                    app_state = ""
-                    found_ports = False
-                    found_error = False
-                    any_good = False
-                    app_state += "Found " + app["Names"][0]
-                    app_state += " State " + app["State"] + " Status " + app["Status"] + " "
-                    ports = app["Ports"]
-                    nports = 0
-                    # If this is the P1 app (or Gammonbot?) then wait for the Private Key (or rejected IP)
-                    for port in ports:
-                        if "IP" in port and port["IP"] == "0.0.0.0" and port["Type"] == "tcp":
-                            found_ports = True
-                            nports += 1
-                            sport = str(port["PublicPort"])
-                            app_state += sport + " "
-                            node_ip = get_node_ip_or_local(this_node["ip"])
-                            sock = node_connection(port["PublicPort"], node_ip)
-                            if isinstance(sock, str):
-                                app_state += "FAILED " + sock + " "
-                                found_error = True
-                                add_db(db, this_node["collateral"], this_node["ip"], status, 100, tier + " " + app["Names"][0] +" " +str(sport) + " Error: " + sock)
-                            else:
-                                app_state += "OK "
-                                any_good = True
-                                sock.close()
-                                add_db(db, this_node["collateral"], this_node["ip"], status, 100, tier + " " + app["Names"][0] +" " +str(sport) + " OK")
-                    if found_ports:
-                        num_checked += 1
-                        if not found_error:
-                            num_good += 1
-                        #print(logmsg(this_node['ip'] + " " + status + " " + tier + " " + app_state))
-                        if not any_good:
-                            print(logmsg(this_node['ip'] + " " + status + " " + tier + " All Ports " + str(nports) + " failed"))
-                    else:
-                        add_db(db, this_node["collateral"], this_node["ip"], status, 100, tier + " " + app["Names"][0])
-            print("Summary: ", num_nodes, " found, ", num_checked, " nodes checked, ", num_good, " found with no issues")
-            if db is not None:
-                db.close()
-        else:
-            print(values)
-    else:
-        print(req)
-
-def mysql_init(my_host, my_user, my_passwd, my_db):
-    '''Check DB to see that it exists and create tables if needed'''
-    NODE_STATUS_TABLE = '''CREATE TABLE `fluxdb`.`node_status` (
-        `node_status_id` INT(11) NOT NULL AUTO_INCREMENT ,
-        `time` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ,
-        `node_ip` VARCHAR(64) NOT NULL ,
-        `node_health` TINYINT(4) NOT NULL,
-        `node_state` VARCHAR(64) NOT NULL ,
-        `node_comment` VARCHAR(255) NOT NULL,
-        PRIMARY KEY (`node_status_id`)) ENGINE = InnoDB;'''
-  
-    dataBase = mysql.connector.connect(host = my_host, user = my_user, passwd = my_passwd, database = my_db)
-    cursorObject = dataBase.cursor()
-    cursorObject.execute("SHOW TABLES;")
-    result = cursorObject.fetchall()
-    if len(result) == 0: # Empty db create table(s)
-        cursorObject.execute(NODE_STATUS_TABLE)
-    cursorObject.close()
-    return dataBase
-
+        return window_start(option_from_argv(argv, "--since", None), option_from_argv(argv, "--window", None))
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+
+# command: (takes a value, needs a db, function)
+COMMANDS = {
+    "--examine": (False, True, run_examine),
+    "--details": (True, True, run_details),
+    "--prune": (True, True, run_prune),
+    "--export-parquet": (True, True, run_export),
+    "--fix": (False, True, run_fix),
+    "--all": (False, False, lambda store, value, argv: run_scan(store, "", argv, "--all")),
+    "--filter": (True, False, lambda store, value, argv: run_scan(store, value, argv, "--filter")),
+    "--app": (True, False, lambda store, value, argv: run_scan(store, value, argv, "--app")),
+}
+
+def command_from_argv(argv):
+    '''Remove the first command (and its value) from argv, return (command, value) or (None, None)'''
+    for pos in range(1, len(argv)):
+        command = argv[pos].lower()
+        if command in COMMANDS:
+            if not COMMANDS[command][0]:
+                del argv[pos]
+                return command, None
+            if len(argv) > pos + 1:
+                value = argv[pos + 1]
+                del argv[pos:pos + 2]
+                return command, value
+            return None, None
+    return None, None
 
 if __name__ == "__main__":
-    signal.signal(signal.SIGINT, handler)
-
-    if len(sys.argv) > 1:
-        dataBase = None
-        filter = None
-        arg = 1
-        if sys.argv[arg].lower() == "--mysql" and len(sys.argv)> arg+4:
-            dataBase = mysql_init(sys.argv[arg+1], sys.argv[arg+2], sys.argv[arg+3], sys.argv[arg+4])
-        arg = arg + 5
-        if len(sys.argv) > arg and sys.argv[arg].lower() == "--examine":
-            examine_db(dataBase)
-            sys.exit(0)
-        if len(sys.argv) > arg and sys.argv[arg].lower() == "--all":
-            filter = ""
-            arg = arg + 1
-        if len(sys.argv) > arg and sys.argv[arg].lower() == "--filter":
-            if len(sys.argv) > arg+1:
-                filter = sys.argv[arg+1]
-        if filter is not None:
-            check_nodes(filter, dataBase)
-            sys.exit(0)
-        if len(sys.argv) > arg and sys.argv[arg].lower() == "--app":
-            if len(sys.argv) > arg+1:
-                name = sys.argv[arg+1]
-                check_app(name)
-                sys.exit(0)
-    print("Incorrect arguments:")
-    print(sys.argv[0], "--mysql host-ip-dns username passwd dbname - must be first if present")
-    print(sys.argv[0], "--all    check all nodes for running applications to test")
-    print(sys.argv[0], "--filter check nodes matching the supplied `filter` for running applications to test")
-    print(sys.argv[0], "--app    test nodes running application 'app'")
-    # peers = get_flux("192.168.8.89:16197", "flux/connectedpeers")
-    # print(peers)
-    # data = get_flux("192.168.8.89:16197", "flux/incomingconnections")
-    # print(data)
-    # if "::ffff:185.218.126.171" in data:
-    #     print("Test Passed")
-    # else:
-    #     print("Test Failed")
-    # for peer in peers:
-    #     if "::ffff:"+peer in data:
-    #         print("Found", peer)
-    sys.exit(1)
+    shards = option_from_argv(sys.argv, "--shards", 0)
+    if shards > 0:
+        from flux_scan import run_shards
+        sys.exit(run_shards(sys.argv, shards))
+    if "--profile" in sys.argv:
+        from flux_profile import profile_from_argv
+        profile_from_argv(sys.argv)
+    dataBase = open_db(sys.argv)
+    cmd, cmd_value = command_from_argv(sys.argv)
+    if cmd is None:
+        usage()
+    if COMMANDS[cmd][1] and dataBase is None:
+        print(cmd, "needs --mysql or --sqlite")
+        sys.exit(1)
+    COMMANDS[cmd][2](dataBase, cmd_value, sys.argv)
+    sys.exit(0)
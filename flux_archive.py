@@ -0,0 +1,98 @@
+'''Record a sweep's network answers and replay them later
+
+With --record name every central API answer, node API answer and port probe
+result is appended to a gzip compressed JSON lines file as it arrives. With
+--replay name the scanner takes its answers from that file instead of the
+network, so a change to the checks can be run against a real sweep in
+seconds and the run time only measures the Python side.
+'''
+import atexit
+import gzip
+import json
+import threading
+from flux_options import option_from_argv
+
+VERSION = 1
+
+class Archive:
+    '''A recording being written, or a loaded one being replayed'''
+    def __init__(self, filename, replaying=False):
+        self.filename = filename
+        self.replaying = replaying
+        self.lock = threading.Lock()
+        self.api_data = {}
+        self.flux_data = {}
+        self.probes = {}
+        self.file = None
+        if replaying:
+            self.load()
+        else:
+            self.file = gzip.open(filename, "wt", encoding="utf-8")
+            self.write(["archive", VERSION])
+
+    def write(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def load(self):
+        with gzip.open(self.filename, "rt", encoding="utf-8") as file:
+            try:
+                for line in file:
+                    record = json.loads(line)
+                    if record[0] == "a":
+                        self.api_data[record[1]] = record[2]
+                    elif record[0] == "f":
+                        self.flux_data[(record[1], record[2])] = record[3]
+                    elif record[0] == "p":
+                        self.probes[(record[1], record[2])] = (record[3], record[4])
+            except (EOFError, ValueError):
+                # A recording cut short by Ctrl-C, use what was written
+                pass
+
+    def record_api(self, path, data):
+        self.write(["a", path, data])
+
+    def record_flux(self, the_node, path, data):
+        self.write(["f", the_node, path, data])
+
+    def record_probe(self, node_ip, port, result, ms):
+        self.write(["p", node_ip, port, result, ms])
+
+    def api(self, path):
+        '''Recorded central API answer, None if it was not recorded'''
+        data = self.api_data.get(path)
+        if isinstance(data, list):
+            # check_nodes empties the node list as it goes, keep the recording for the next call
+            return list(data)
+        return data
+
+    def flux(self, the_node, path):
+        '''Recorded node API answer, None (as for a failed call) if it was not recorded'''
+        return self.flux_data.get((the_node, path))
+
+    def probe(self, node_ip, port):
+        '''Recorded (result, ms) of a port probe'''
+        return self.probes.get((node_ip, port), ("NotRecorded", 0))
+
+    def close(self):
+        if self.file is not None:
+            with self.lock:
+                self.file.close()
+                self.file = None
+
+def archive_from_argv(argv):
+    '''Remove --record name and --replay name from argv, return an Archive or None
+
+    Raises OSError if the file can not be opened and ValueError if both are given.
+    '''
+    replay = option_from_argv(argv, "--replay", None)
+    record = option_from_argv(argv, "--record", None)
+    if replay is not None and record is not None:
+        raise ValueError("--record and --replay can not be used together")
+    if replay is not None:
+        return Archive(replay, replaying=True)
+    if record is not None:
+        archive = Archive(record)
+        atexit.register(archive.close)
+        return archive
+    return None
@@ -0,0 +1,110 @@
+'''Result cache for Flux API calls, keyed by node and API path'''
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from flux_options import option_from_argv
+
+# Seconds a result stays fresh, matched by API path prefix (longest wins).
+# Paths that match nothing are never cached.
+DEFAULT_TTL = {
+    "daemon/getzelnodestatus": 120,
+    "apps/listrunningapps": 120,
+    "flux/connectedpeers": 60,
+    "flux/incomingconnections": 60,
+}
+DEFAULT_MAX_ENTRIES = 8192
+
+class FluxCache:
+    '''Size bounded LRU cache of get_flux results with a TTL per endpoint'''
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=None, path=None):
+        self.max_entries = max_entries
+        self.ttl = dict(DEFAULT_TTL if ttl is None else ttl)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if path is not None:
+            self.load()
+
+    def ttl_for(self, path):
+        '''Return the TTL for an API path, 0 if it should not be cached'''
+        best = ""
+        for prefix in self.ttl:
+            if path.startswith(prefix) and len(prefix) > len(best):
+                best = prefix
+        if len(best) == 0:
+            return 0
+        return self.ttl[best]
+
+    def lookup(self, node, path):
+        '''Return (True, data) for a fresh entry, otherwise (False, None)'''
+        key = node + "/" + path
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, entry[1]
+                del self._entries[key]
+            self.misses += 1
+        return False, None
+
+    def store(self, node, path, data):
+        '''Save a successful result, evicting the least recently used entries'''
+        ttl = self.ttl_for(path)
+        if ttl <= 0 or data is None:
+            return
+        key = node + "/" + path
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def load(self):
+        '''Read unexpired entries saved by a previous run'''
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                saved = json.loads(file.read())
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        with self._lock:
+            for key, expires, data in saved:
+                if expires > now:
+                    self._entries[key] = (expires, data)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self):
+        '''Write the unexpired entries to disk, oldest first to keep LRU order'''
+        if self.path is None:
+            return
+        now = time.time()
+        with self._lock:
+            saved = [[key, entry[0], entry[1]] for key, entry in self._entries.items() if entry[0] > now]
+        tmp_name = self.path + ".tmp"
+        try:
+            with open(tmp_name, 'w', encoding="utf-8") as file:
+                file.write(json.dumps(saved))
+            os.replace(tmp_name, self.path)
+        except OSError:
+            print("Save cache failed", self.path)
+
+def cache_from_argv(argv):
+    '''Remove --cache / --cache-file name from argv and return a FluxCache or None'''
+    cache = None
+    if "--cache" in argv:
+        argv.remove("--cache")
+        cache = FluxCache()
+    path = option_from_argv(argv, "--cache-file", None)
+    if path is not None:
+        cache = FluxCache(path=path)
+    if cache is not None and cache.path is not None:
+        atexit.register(cache.save)
+    return cache
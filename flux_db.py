@@ -0,0 +1,240 @@
+'''Database backends for the node_status table, MySQL or SQLite'''
+import sqlite3
+from datetime import datetime
+
+# Lower bound used when a query has no time window, so every statement keeps one shape
+EPOCH = datetime(1970, 1, 2)
+
+MYSQL_NODE_STATUS_TABLE = '''CREATE TABLE `node_status` (
+    `node_status_id` INT(11) NOT NULL AUTO_INCREMENT ,
+    `time` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ,
+    `node_hash` VARCHAR(128) NULL ,
+    `node_ip` VARCHAR(64) NOT NULL ,
+    `node_health` TINYINT(4) NOT NULL,
+    `node_state` VARCHAR(64) NOT NULL ,
+    `node_comment` VARCHAR(255) NOT NULL,
+    PRIMARY KEY (`node_status_id`),
+    KEY `hash_time` (`node_hash`, `time`),
+    KEY `time` (`time`),
+    KEY `node_ip` (`node_ip`)) ENGINE = InnoDB;'''
+
+# Same columns and order as MySQL so SELECT * rows look the same
+SQLITE_NODE_STATUS_TABLE = '''CREATE TABLE IF NOT EXISTS `node_status` (
+    `node_status_id` INTEGER PRIMARY KEY AUTOINCREMENT,
+    `time` TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+    `node_hash` VARCHAR(128) NULL,
+    `node_ip` VARCHAR(64) NOT NULL,
+    `node_health` TINYINT NOT NULL,
+    `node_state` VARCHAR(64) NOT NULL,
+    `node_comment` VARCHAR(255) NOT NULL)'''
+
+MYSQL_NODE_STATUS_DAILY_TABLE = '''CREATE TABLE IF NOT EXISTS `node_status_daily` (
+    `day` DATE NOT NULL ,
+    `node_hash` VARCHAR(128) NULL ,
+    `node_ip` VARCHAR(64) NOT NULL ,
+    `samples` INT(11) NOT NULL ,
+    `health_sum` INT(11) NOT NULL ,
+    `health_min` TINYINT(4) NOT NULL ,
+    KEY `hash_day` (`node_hash`, `day`)) ENGINE = InnoDB;'''
+
+SQLITE_NODE_STATUS_DAILY_TABLE = '''CREATE TABLE IF NOT EXISTS `node_status_daily` (
+    `day` DATE NOT NULL,
+    `node_hash` VARCHAR(128) NULL,
+    `node_ip` VARCHAR(64) NOT NULL,
+    `samples` INTEGER NOT NULL,
+    `health_sum` INTEGER NOT NULL,
+    `health_min` TINYINT NOT NULL)'''
+
+MYSQL_NODE_LAST_STATE_TABLE = '''CREATE TABLE IF NOT EXISTS `node_last_state` (
+    `node_hash` VARCHAR(128) NOT NULL ,
+    `app` VARCHAR(128) NOT NULL ,
+    `port` VARCHAR(16) NOT NULL ,
+    `node_ip` VARCHAR(64) NOT NULL ,
+    `state` VARCHAR(64) NOT NULL ,
+    `time` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ,
+    PRIMARY KEY (`node_hash`, `app`, `port`)) ENGINE = InnoDB;'''
+
+SQLITE_NODE_LAST_STATE_TABLE = '''CREATE TABLE IF NOT EXISTS `node_last_state` (
+    `node_hash` VARCHAR(128) NOT NULL,
+    `app` VARCHAR(128) NOT NULL,
+    `port` VARCHAR(16) NOT NULL,
+    `node_ip` VARCHAR(64) NOT NULL,
+    `state` VARCHAR(64) NOT NULL,
+    `time` TIMESTAMP NOT NULL DEFAULT (datetime('now', 'localtime')),
+    PRIMARY KEY (`node_hash`, `app`, `port`))'''
+
+# node_status indexes added to a MySQL table created before they were part of MYSQL_NODE_STATUS_TABLE
+MYSQL_INDEXES = (
+    ("hash_time", "(`node_hash`, `time`)"),
+    ("time", "(`time`)"),
+    ("node_ip", "(`node_ip`)"),
+)
+
+SQLITE_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS `hash_time` ON `node_status` (`node_hash`, `time`)",
+    "CREATE INDEX IF NOT EXISTS `time` ON `node_status` (`time`)",
+    "CREATE INDEX IF NOT EXISTS `node_ip` ON `node_status` (`node_ip`)",
+    "CREATE INDEX IF NOT EXISTS `hash_day` ON `node_status_daily` (`node_hash`, `day`)",
+)
+
+def is_sqlite(db):
+    '''True for a SQLite connection'''
+    return isinstance(db, sqlite3.Connection)
+
+def sql(db, query):
+    '''Adapt a query written with %s placeholders to the db's parameter style'''
+    if is_sqlite(db):
+        return query.replace("%s", "?")
+    return query
+
+def mysql_init(my_host, my_user, my_passwd, my_db):
+    '''Check DB to see that it exists and create tables if needed'''
+    import mysql.connector
+    dataBase = mysql.connector.connect(host = my_host, user = my_user, passwd = my_passwd, database = my_db)
+    cursorObject = dataBase.cursor()
+    cursorObject.execute("SHOW TABLES;")
+    result = cursorObject.fetchall()
+    if len(result) == 0: # Empty db create table(s)
+        cursorObject.execute(MYSQL_NODE_STATUS_TABLE)
+    cursorObject.execute(MYSQL_NODE_STATUS_DAILY_TABLE)
+    cursorObject.execute(MYSQL_NODE_LAST_STATE_TABLE)
+    cursorObject.execute("SHOW INDEX FROM `node_status`;")
+    keys = set(row[2] for row in cursorObject.fetchall())
+    for name, columns in MYSQL_INDEXES:
+        if name not in keys:
+            print("Adding index", name, "to node_status")
+            cursorObject.execute("ALTER TABLE `node_status` ADD KEY `" + name + "` " + columns + ";")
+    cursorObject.close()
+    return dataBase
+
+def sqlite_init(path):
+    '''Open (creating if needed) a SQLite db in WAL mode with the node_status table'''
+    # Shard processes share the file, wait for each other's write transactions
+    dataBase = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, timeout=60)
+    dataBase.execute("PRAGMA journal_mode=WAL")
+    dataBase.execute("PRAGMA synchronous=NORMAL")
+    dataBase.execute(SQLITE_NODE_STATUS_TABLE)
+    dataBase.execute(SQLITE_NODE_STATUS_DAILY_TABLE)
+    dataBase.execute(SQLITE_NODE_LAST_STATE_TABLE)
+    for index in SQLITE_INDEXES:
+        dataBase.execute(index)
+    dataBase.commit()
+    return dataBase
+
+class NodeStatusDb:
+    '''All node_status queries, each with its own reusable cursor
+
+    On MySQL the cursors are server side prepared statements, parsed once and
+    then executed with new parameters. SQLite caches the compiled statement
+    for a reused cursor the same way.
+    '''
+    INSERT = "INSERT INTO `node_status` (`node_hash`, `node_ip`, `node_state`, `node_health`, `node_comment`) VALUES (%s, %s, %s, %s, %s)"
+    SUMMARY = "SELECT count(*), sum(`node_health`), `node_hash`, MAX(`node_ip`) FROM `node_status`" + \
+        " WHERE `time` >= %s GROUP BY `node_hash` ORDER BY count(*) DESC"
+    DETAILS = "SELECT * FROM `node_status` WHERE `node_hash` = %s AND `time` >= %s ORDER BY `time` ASC"
+    STATES = "SELECT `node_state`, `node_comment`, `node_ip` FROM `node_status` WHERE `node_hash` = %s AND `time` >= %s ORDER BY `time` ASC"
+    SET_HASH = "UPDATE `node_status` SET `node_hash` = %s WHERE `node_ip` = %s AND `node_hash` IS NULL"
+    SAMPLES = "SELECT `node_hash`, `node_ip`, `node_state`, `node_health` FROM `node_status`" + \
+        " WHERE `time` >= %s ORDER BY `node_hash`, `time`"
+    EXPORT = "SELECT `time`, `node_hash`, `node_ip`, `node_state`, `node_health`, `node_comment` FROM `node_status` ORDER BY `time` ASC"
+    ROLLUP = "INSERT INTO `node_status_daily` (`day`, `node_hash`, `node_ip`, `samples`, `health_sum`, `health_min`)" + \
+        " SELECT DATE(`time`), `node_hash`, MAX(`node_ip`), count(*), sum(`node_health`), min(`node_health`)" + \
+        " FROM `node_status` WHERE `time` < %s GROUP BY DATE(`time`), `node_hash`"
+    LAST_STATES = "SELECT `node_hash`, `app`, `port`, `state` FROM `node_last_state`"
+    SET_STATE = "REPLACE INTO `node_last_state` (`node_hash`, `app`, `port`, `node_ip`, `state`) VALUES (%s, %s, %s, %s, %s)"
+    DELETE_BEFORE = "DELETE FROM `node_status` WHERE `time` < %s"
+
+    def __init__(self, db):
+        self.db = db
+        self.cursors = {}
+
+    def cursor(self, query):
+        '''Return (cursor, query text) for query, creating the cursor on first use'''
+        if query not in self.cursors:
+            if is_sqlite(self.db):
+                self.cursors[query] = self.db.cursor()
+            else:
+                self.cursors[query] = self.db.cursor(prepared=True)
+        return self.cursors[query], sql(self.db, query)
+
+    def execute(self, query, params):
+        cur, text = self.cursor(query)
+        cur.execute(text, params)
+        return cur
+
+    def insert(self, rows):
+        '''Insert (node_hash, node_ip, node_state, node_health, node_comment) rows in one transaction'''
+        # A plain cursor lets mysql.connector turn executemany into one multi row INSERT
+        cur = self.db.cursor()
+        cur.executemany(sql(self.db, self.INSERT), rows)
+        cur.close()
+        self.db.commit()
+
+    def summary(self, since=None):
+        '''(count, health sum, node_hash, node_ip) per node, most samples first'''
+        return self.execute(self.SUMMARY, (since or EPOCH,)).fetchall()
+
+    def details(self, node_hash, since=None):
+        '''Every column of every sample for a node, oldest first'''
+        return self.execute(self.DETAILS, (node_hash, since or EPOCH)).fetchall()
+
+    def states(self, node_hash, since=None):
+        '''(node_state, node_comment, node_ip) of every sample for a node, oldest first'''
+        return self.execute(self.STATES, (node_hash, since or EPOCH)).fetchall()
+
+    def set_hash(self, node_hash, node_ip):
+        '''Fill in the hash of old samples that only have an IP, returns rows changed'''
+        return self.execute(self.SET_HASH, (node_hash, node_ip)).rowcount
+
+    def samples(self, since=None, batch=10000):
+        '''Yield (node_hash, node_ip, node_state, node_health) of every sample by node, oldest first'''
+        cur = self.db.cursor()
+        cur.execute(sql(self.db, self.SAMPLES), (since or EPOCH,))
+        while True:
+            rows = cur.fetchmany(batch)
+            if len(rows) == 0:
+                break
+            yield from rows
+        cur.close()
+
+    def export(self, batch=10000):
+        '''Yield all samples oldest first as (time, hash, ip, state, health, comment)'''
+        cur = self.db.cursor()
+        cur.execute(self.EXPORT)
+        while True:
+            rows = cur.fetchmany(batch)
+            if len(rows) == 0:
+                break
+            yield from rows
+        cur.close()
+
+    def prune(self, cutoff):
+        '''Roll samples before cutoff into node_status_daily and delete them, returns (days, samples)'''
+        days = self.execute(self.ROLLUP, (cutoff,)).rowcount
+        samples = self.execute(self.DELETE_BEFORE, (cutoff,)).rowcount
+        self.db.commit()
+        return days, samples
+
+    def last_states(self):
+        '''{(node_hash, app, port): state} for everything seen, app and port are "" for the node itself'''
+        cur = self.db.cursor()
+        cur.execute(self.LAST_STATES)
+        states = {(row[0], row[1], row[2]): row[3] for row in cur.fetchall()}
+        cur.close()
+        return states
+
+    def set_states(self, rows):
+        '''Save (node_hash, app, port, node_ip, state) rows as the latest known states'''
+        cur = self.db.cursor()
+        cur.executemany(sql(self.db, self.SET_STATE), rows)
+        cur.close()
+        self.db.commit()
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        for cur in self.cursors.values():
+            cur.close()
+        self.cursors = {}
+        self.db.close()
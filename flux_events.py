@@ -0,0 +1,134 @@
+'''Report state changes as scan results arrive
+
+TransitionSink remembers the last state of every node and every app port it
+has seen, optionally in the node_last_state table so it carries over between
+runs, and sends an event only when a state changes (CONFIRMED -> noapiport,
+OK -> Refused on a port). Events go to an EventLog file and/or a Webhook.
+'''
+import json
+import sys
+import threading
+from datetime import datetime
+from flux_sinks import ResultSink
+
+class EventLog:
+    '''Append events as JSON lines, filename '-' is stdout'''
+    def __init__(self, filename):
+        if filename == "-":
+            self.file = sys.stdout
+        else:
+            self.file = open(filename, "a", encoding="utf-8")
+
+    def send(self, event):
+        # Transitions are rare and someone may be tailing the log, write each one out now
+        self.file.write(json.dumps(event) + "\n")
+        self.file.flush()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.file is sys.stdout:
+            self.file.flush()
+        else:
+            self.file.close()
+
+class Webhook:
+    '''POST each event as JSON to url from a background thread so probes never wait on it'''
+    def __init__(self, url, timeout=5):
+        import queue
+        self.url = url
+        self.timeout = timeout
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="webhook", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        import urllib.request
+        while True:
+            event = self.queue.get()
+            if event is None:
+                break
+            request = urllib.request.Request(self.url, data=json.dumps(event).encode(),
+                headers={"Content-Type": "application/json"})
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except OSError as error:
+                print("Webhook ", self.url, " failed: ", error, file=sys.stderr)
+
+    def send(self, event):
+        self.queue.put(event)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        '''Send what is queued, then stop'''
+        self.queue.put(None)
+        self.thread.join()
+
+class TransitionSink(ResultSink):
+    '''Send an event to every output when a node or app port changes state
+
+    A state seen for the first time is only remembered. With a
+    flux_db.NodeStatusDb store the states are loaded at start and the changed
+    ones saved on flush, the store is left open for the other sinks.
+    '''
+    def __init__(self, outputs, store=None):
+        self.outputs = outputs
+        self.store = store
+        self.states = store.last_states() if store is not None else {}
+        self.changed = {}
+
+    def update(self, this_node, app, port, state, comment):
+        key = (str(this_node["collateral"]), app, port)
+        old = self.states.get(key)
+        if old == state:
+            return
+        self.states[key] = state
+        self.changed[key] = (this_node["ip"], state)
+        if old is None:
+            return
+        event = {'time': datetime.now().isoformat(timespec="seconds"), 'node_hash': key[0],
+            'node_ip': this_node["ip"], 'app': app, 'port': port, 'old': old, 'new': state, 'comment': comment}
+        for output in self.outputs:
+            output.send(event)
+
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        self.update(this_node, "", "", nstatus, comment)
+        if len(port) > 0:
+            self.update(this_node, app, port, status, comment)
+
+    def pending(self):
+        return len(self.changed)
+
+    def flush(self):
+        if self.store is not None and len(self.changed) > 0:
+            self.store.set_states([key + value for key, value in self.changed.items()])
+        self.changed = {}
+        for output in self.outputs:
+            output.flush()
+
+    def close(self):
+        self.flush()
+        for output in self.outputs:
+            output.close()
+
+def events_from_argv(argv, store=None):
+    '''Remove --events name and --webhook url from argv, return a TransitionSink or None'''
+    outputs = []
+    for option in ("--events", "--webhook"):
+        while option in argv:
+            pos = argv.index(option)
+            if len(argv) <= pos + 1:
+                del argv[pos]
+                continue
+            name = argv[pos + 1]
+            del argv[pos:pos + 2]
+            if option == "--events":
+                outputs.append(EventLog(name))
+            else:
+                outputs.append(Webhook(name))
+    if len(outputs) == 0:
+        return None
+    return TransitionSink(outputs, store)
@@ -0,0 +1,151 @@
+'''Classify nodes from their samples in one pass
+
+Samples are (node_hash, node_ip, node_state, node_health) whether they come
+from node_status or straight from a scan. Each node keeps a few counters and
+one count per state it has been in, never its sample list, and a ScorePolicy
+turns those counters into Perfect, Healed, Mixed, Young, expired or the name
+of a hard failure state.
+'''
+import sys
+from flux_sinks import ResultSink
+
+class NodeHealth:
+    '''Running totals for one node'''
+    __slots__ = ("node_hash", "node_ip", "count", "health", "states", "last_state")
+
+    def __init__(self, node_hash):
+        self.node_hash = node_hash
+        self.node_ip = "unknown"
+        self.count = 0
+        self.health = 0
+        self.states = {}
+        self.last_state = "CONFIRMED"
+
+    def add(self, node_ip, state, health):
+        '''Count one sample, samples must arrive oldest first'''
+        self.count += 1
+        self.health += int(health)
+        self.states[state] = self.states.get(state, 0) + 1
+        self.last_state = state
+        self.node_ip = node_ip
+
+    def average(self):
+        return self.health / self.count if self.count > 0 else 0.0
+
+    def common_state(self):
+        '''Most frequent state, the first seen wins a tie'''
+        return max(self.states, key=self.states.get) if len(self.states) > 0 else ""
+
+class ScorePolicy:
+    '''Thresholds used to classify a node
+
+    healthy - average score for Perfect (and a healthy Young node)
+    good - average score a Mixed node needs to count as Healed (or a good Young node)
+    young - nodes with fewer samples are Young
+    '''
+    def __init__(self, good=80.0, healthy=99.0, young=3):
+        self.good = good
+        self.healthy = healthy
+        self.young = young
+
+    def classify(self, node):
+        '''Category name for a NodeHealth'''
+        avg = node.average()
+        if node.count < self.young:
+            return "Young"
+        if avg >= self.healthy:
+            return "Perfect"
+        if len(node.states) == 1:
+            return node.last_state
+        if node.last_state == "expired":
+            return "expired"
+        if node.last_state == "CONFIRMED" and node.common_state() == "CONFIRMED" and avg > self.good:
+            return "Healed"
+        return "Mixed"
+
+    def young_grade(self, node):
+        '''"healthy", "good" or "" for a Young node'''
+        avg = node.average()
+        if avg > self.healthy:
+            return "healthy"
+        if avg > self.good:
+            return "good"
+        return ""
+
+def stream(rows, policy=None):
+    '''Yield (category, NodeHealth) for rows ordered by node_hash then time
+
+    Only the node being read is held, so any number of rows can be classified.
+    '''
+    policy = policy or ScorePolicy()
+    node = None
+    for node_hash, node_ip, state, health in rows:
+        if node is None or node.node_hash != node_hash:
+            if node is not None:
+                yield policy.classify(node), node
+            node = NodeHealth(node_hash)
+        node.add(node_ip, state, health)
+    if node is not None:
+        yield policy.classify(node), node
+
+class HealthReport:
+    '''Node counts per category, keeping the nodes that need a look'''
+    def __init__(self, policy=None):
+        self.policy = policy or ScorePolicy()
+        self.counts = {"expired": 0, "Mixed": 0, "Healed": 0}
+        self.young = {"healthy": 0, "good": 0}
+        self.mixed = []
+
+    def add(self, category, node):
+        self.counts[category] = self.counts.get(category, 0) + 1
+        if category == "Young":
+            grade = self.policy.young_grade(node)
+            if grade in self.young:
+                self.young[grade] += 1
+        elif category == "Mixed":
+            self.mixed.append((node.node_hash, node.node_ip, dict(node.states)))
+
+    def add_all(self, rows):
+        '''Classify rows ordered by node_hash then time'''
+        for category, node in stream(rows, self.policy):
+            self.add(category, node)
+        return self
+
+    def show(self, file=None):
+        file = file or sys.stdout
+        for name, count in self.counts.items():
+            if name == "Mixed":
+                continue
+            if name == "Young":
+                print("%6d Young (%d appear healthy)" % (count, self.young["healthy"]), file=file)
+            else:
+                print("%6d %s" % (count, name), file=file)
+        print("%6d Mixed Results" % self.counts["Mixed"], file=file)
+        for mixed in self.mixed:
+            print(mixed[0], mixed[1], mixed[2], file=file)
+
+class HealthSink(ResultSink):
+    '''Classify nodes from live scan results, printing the report on close
+
+    Results can arrive in any order, one NodeHealth is kept per node.
+    '''
+    def __init__(self, policy=None, file=None):
+        self.policy = policy or ScorePolicy()
+        self.file = file or sys.stderr
+        self.nodes = {}
+
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        node_hash = str(this_node["collateral"])
+        node = self.nodes.get(node_hash)
+        if node is None:
+            node = self.nodes[node_hash] = NodeHealth(node_hash)
+        node.add(this_node["ip"], nstatus, health)
+
+    def report(self):
+        report = HealthReport(self.policy)
+        for node in self.nodes.values():
+            report.add(self.policy.classify(node), node)
+        return report
+
+    def close(self):
+        self.report().show(self.file)
@@ -0,0 +1,25 @@
+'''Command line option helpers shared by the CLIs, kept free of heavy imports'''
+
+def option_from_argv(argv, name, default):
+    '''Remove "name value" from argv and return value converted like default'''
+    if name not in argv:
+        return default
+    pos = argv.index(name)
+    if len(argv) <= pos + 1:
+        del argv[pos]
+        return default
+    value = argv[pos + 1]
+    del argv[pos:pos + 2]
+    if default is None:
+        return value
+    return type(default)(value)
+
+# Options that choose where check_nodes results go, --app prints its own table instead
+OUTPUT_OPTIONS = ("--csv", "--jsonl", "--parquet", "--stdout", "--flush-interval", "--events", "--webhook", "--health")
+
+def reject_for_app(argv):
+    '''Exit with a message if argv has an output option, which --app would ignore'''
+    used = [option for option in OUTPUT_OPTIONS if option in argv]
+    if len(used) > 0:
+        print("--app prints its results,", " ".join(used), "can not be used with it")
+        raise SystemExit(1)
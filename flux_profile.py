@@ -0,0 +1,134 @@
+'''Sampling profiler for the CLIs, --profile name
+
+A daemon thread looks at the stack of every thread each few milliseconds.
+Stacks are written to name in the collapsed format flamegraph.pl and
+speedscope read ("thread;file:function;... samples" per line), and the
+wall time is split into network wait, JSON decode, database, waiting on
+other threads and plain Python work on stderr when the run ends.
+'''
+import atexit
+import os
+import sys
+import threading
+import time
+from flux_options import option_from_argv
+
+CATEGORIES = ("network", "json", "db", "wait", "python")
+
+# A thread whose innermost frame is one of these is waiting on another thread or the rate limiter
+WAIT_FILES = ("threading.py", "queue.py", "flux_ratelimit.py")
+WAIT_FUNCTIONS = ("_worker", "sleep", "acquire")
+# (category, file names, function names) a frame anywhere in the stack can match, first rule wins
+RULES = (
+    ("db", ("flux_db.py", "dbapi2.py"), ()),
+    ("json", ("decoder.py", "encoder.py"), ()),
+    ("network", ("socket.py", "ssl.py", "client.py", "connection.py", "connectionpool.py", "adapters.py"),
+        ("connect_port", "node_connection", "getaddrinfo", "_lookup")),
+)
+
+def category(frames, blocked=False):
+    '''Category of a stack given innermost first as (file name, function name)
+
+    blocked is True when the thread used no CPU since the last sample, it is
+    then inside a C call such as time.sleep or SimpleQueue.get that has no
+    frame of its own.
+    '''
+    if len(frames) > 0 and (frames[0][0] in WAIT_FILES or frames[0][1] in WAIT_FUNCTIONS):
+        return "wait"
+    for name, files, functions in RULES:
+        for filename, function in frames:
+            if filename in files or function in functions:
+                return name
+    if blocked:
+        return "wait"
+    return "python"
+
+def thread_cpu(ident):
+    '''CPU seconds used by a thread, None where the platform can not tell'''
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+class Profiler:
+    '''Sample all threads every interval seconds until stopped'''
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = {}
+        self.seconds = {}
+        self.running = False
+        self.thread = None
+        self.start_time = 0.0
+        self.elapsed = 0.0
+        self.cpu = {}
+
+    def start(self):
+        self.running = True
+        self.start_time = time.monotonic()
+        self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+        self.thread.start()
+
+    def run(self):
+        me = threading.get_ident()
+        last = time.monotonic()
+        while self.running:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            step = now - last
+            last = now
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append((os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+                    frame = frame.f_back
+                cpu = thread_cpu(ident)
+                blocked = cpu is not None and ident in self.cpu and cpu - self.cpu[ident] < step / 10
+                self.cpu[ident] = cpu
+                thread = "main" if ident == threading.main_thread().ident else "workers"
+                key = (thread, category(frames, blocked))
+                self.seconds[key] = self.seconds.get(key, 0.0) + step
+                stack = ";".join([names.get(ident, "thread")] + [name + ":" + function for name, function in reversed(frames)])
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            self.thread.join()
+            self.elapsed = time.monotonic() - self.start_time
+
+    def write(self, filename):
+        '''Write the collapsed stacks to filename'''
+        with open(filename, "w", encoding="utf-8") as file:
+            for stack, count in sorted(self.stacks.items()):
+                file.write(stack + " " + str(count) + "\n")
+
+    def summary(self):
+        '''Seconds per category for the main thread and the worker threads as text'''
+        lines = ["profile %.1f s wall" % self.elapsed, "%-8s %10s %10s" % ("", "main s", "workers s")]
+        for name in CATEGORIES:
+            lines.append("%-8s %10.2f %10.2f" % (name, self.seconds.get(("main", name), 0.0),
+                self.seconds.get(("workers", name), 0.0)))
+        return "\n".join(lines)
+
+def finish(profiler, filename):
+    profiler.stop()
+    profiler.write(filename)
+    print(profiler.summary(), file=sys.stderr)
+    print("Collapsed stacks written to", filename, file=sys.stderr)
+
+def start_profile(filename, interval=0.005):
+    '''Start a Profiler that writes filename and prints its summary when the process exits'''
+    profiler = Profiler(interval)
+    profiler.start()
+    atexit.register(finish, profiler, filename)
+    return profiler
+
+def profile_from_argv(argv):
+    '''Remove --profile name from argv, return a started Profiler or None'''
+    filename = option_from_argv(argv, "--profile", None)
+    if filename is None:
+        return None
+    return start_profile(filename)
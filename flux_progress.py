@@ -0,0 +1,208 @@
+'''Live progress of a long sweep
+
+Progress only counts, a background thread renders a status line on stderr
+and an optional local HTTP server returns the same numbers as JSON, so the
+probe loop never waits on either.
+'''
+import json
+import sys
+import threading
+import time
+from flux_options import option_from_argv
+from flux_sinks import ResultSink
+
+class Progress:
+    '''Thread safe counters for a sweep'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.total = 0
+        self.done = 0
+        self.in_flight = 0
+        self.failures = {}
+        self.sink = None
+        self.running = False
+
+    def begin(self, total, sink=None):
+        '''Start counting a sweep of total nodes writing to sink'''
+        with self.lock:
+            self.start = time.monotonic()
+            self.total = total
+            self.done = 0
+            self.failures = {}
+            self.sink = sink
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def request_finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def node_done(self):
+        with self.lock:
+            self.done += 1
+
+    def failed(self, category):
+        with self.lock:
+            self.failures[category] = self.failures.get(category, 0) + 1
+
+    def snapshot(self):
+        '''Current numbers as a dict'''
+        with self.lock:
+            elapsed = time.monotonic() - self.start
+            rate = self.done / elapsed if elapsed > 0 else 0.0
+            eta = (self.total - self.done) / rate if rate > 0 else None
+            result = {'nodes_done': self.done, 'nodes_total': self.total, 'elapsed': round(elapsed, 1),
+                'nodes_per_sec': round(rate, 2), 'eta': None if eta is None else round(eta),
+                'in_flight': self.in_flight, 'failures': dict(self.failures)}
+            sink = self.sink
+        result['backlog'] = sink.pending() if sink is not None else 0
+        return result
+
+    def status_line(self):
+        '''One line summary for the terminal'''
+        snap = self.snapshot()
+        eta = "--:--"
+        if snap['eta'] is not None:
+            eta = "%d:%02d" % (snap['eta'] // 60, snap['eta'] % 60)
+        failures = " ".join(name + "=" + str(count) for name, count in sorted(snap['failures'].items()))
+        return "%d/%d nodes %.1f/s ETA %s in flight %d backlog %d %s" % (snap['nodes_done'], snap['nodes_total'],
+            snap['nodes_per_sec'], eta, snap['in_flight'], snap['backlog'], failures)
+
+    def show(self, interval=1.0):
+        '''Redraw the status line on stderr every interval seconds from a daemon thread'''
+        self.running = True
+        def refresh():
+            while self.running:
+                line = self.status_line()[:200]
+                sys.stderr.write("\r" + line + "\033[K")
+                sys.stderr.flush()
+                time.sleep(interval)
+        threading.Thread(target=refresh, name="progress", daemon=True).start()
+
+    def serve(self, port):
+        '''Serve the snapshot as JSON on http://127.0.0.1:port/ from a daemon thread'''
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        progress = self
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(progress.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        server = ThreadingHTTPServer(("127.0.0.1", port), StatusHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="progress-http", daemon=True).start()
+        return server
+
+    def stop(self):
+        if self.running:
+            self.running = False
+            sys.stderr.write("\r" + self.status_line()[:200] + "\033[K\n")
+
+class ShardProgress(Progress):
+    '''Progress of a --shards run, the sum of what each worker serves on its port'''
+    def __init__(self, ports):
+        super().__init__()
+        self.ports = ports
+        self.last = {}
+
+    def snapshot(self):
+        import urllib.request
+        result = {'nodes_done': 0, 'nodes_total': 0, 'in_flight': 0, 'backlog': 0, 'failures': {},
+            'nodes_per_sec': 0.0, 'shards': 0}
+        for port in self.ports:
+            try:
+                with urllib.request.urlopen("http://127.0.0.1:%d/" % port, timeout=1) as reply:
+                    self.last[port] = json.loads(reply.read())
+            except (OSError, ValueError):
+                # Not listening yet, or finished: a worker stops serving when it exits
+                if port in self.last:
+                    snap = self.last[port]
+                    snap['nodes_done'] = snap['nodes_total']
+                    snap['in_flight'] = snap['backlog'] = 0
+                    snap['nodes_per_sec'] = 0.0
+            if port not in self.last:
+                continue
+            snap = self.last[port]
+            result['shards'] += 1
+            for name in ('nodes_done', 'nodes_total', 'in_flight', 'backlog', 'nodes_per_sec'):
+                result[name] += snap[name]
+            for name, count in snap['failures'].items():
+                result['failures'][name] = result['failures'].get(name, 0) + count
+        result['elapsed'] = round(time.monotonic() - self.start, 1)
+        rate = result['nodes_per_sec']
+        result['nodes_per_sec'] = round(rate, 2)
+        result['eta'] = round((result['nodes_total'] - result['nodes_done']) / rate) if rate > 0 else None
+        return result
+
+def free_port():
+    '''A localhost port nothing is listening on right now'''
+    import socket
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def shard_progress_from_argv(argv, count):
+    '''--progress and --progress-port N for a --shards coordinator
+
+    Removes both options from argv and returns (ShardProgress or None, ports).
+    Worker i is to serve its own progress on ports[i], the coordinator adds
+    them up for its status line and for port N.
+    '''
+    show = "--progress" in argv
+    if show:
+        argv.remove("--progress")
+    port = option_from_argv(argv, "--progress-port", 0)
+    if not show and port == 0:
+        return None, []
+    ports = [free_port() for _ in range(count)]
+    progress = ShardProgress(ports)
+    if show:
+        progress.show()
+    if port > 0:
+        progress.serve(port)
+    return progress, ports
+
+class ProgressSink(ResultSink):
+    '''Pass results on to sink, counting failures by category'''
+    def __init__(self, sink, progress):
+        self.sink = sink
+        self.progress = progress
+
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        if health < 100:
+            self.progress.failed(nstatus)
+        elif status not in ("", "OK"):
+            self.progress.failed("port " + status)
+        self.sink.add(this_node, nstatus, health, comment, tier, app, port, status)
+
+    def pending(self):
+        return self.sink.pending()
+
+    def flush(self):
+        self.sink.flush()
+
+    def close(self):
+        self.sink.close()
+
+def progress_from_argv(argv):
+    '''Remove --progress and --progress-port N from argv, return a started Progress or None'''
+    progress = None
+    if "--progress" in argv:
+        argv.remove("--progress")
+        progress = Progress()
+        progress.show()
+    port = option_from_argv(argv, "--progress-port", 0)
+    if port > 0:
+        if progress is None:
+            progress = Progress()
+        progress.serve(port)
+    return progress
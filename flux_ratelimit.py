@@ -0,0 +1,113 @@
+'''Token bucket rate limiting for API calls and port probes
+
+A RateLimiter has one global bucket and one bucket per host. Timeouts and
+server errors shrink the global rate and put the host on a growing back-off,
+successes slowly bring both back to normal.
+'''
+import threading
+import time
+from flux_options import option_from_argv
+
+DEFAULT_RATE = 50.0     # calls per second for the whole process
+DEFAULT_HOST_RATE = 5.0 # calls per second to any one host
+MAX_BACKOFF = 60.0      # seconds, longest pause for a failing host
+MIN_RATE_FACTOR = 0.1   # global rate never drops below this share of the configured rate
+
+class TokenBucket:
+    '''Allow rate operations per second with bursts of up to burst'''
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        '''Take a token, return how long the caller must wait before using it'''
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        '''Block until a token is available'''
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+class RateLimiter:
+    '''Global and per host token buckets with adaptive back-off'''
+    def __init__(self, rate=DEFAULT_RATE, host_rate=DEFAULT_HOST_RATE, burst=None):
+        self.rate = rate
+        self.host_rate = host_rate
+        self.host_burst = max(1.0, host_rate) if burst is None else burst
+        self.global_bucket = TokenBucket(rate, max(1.0, rate) if burst is None else burst)
+        self.hosts = {}
+        self.backoff = {}
+        self.lock = threading.Lock()
+        self.failures = 0
+
+    def host_bucket(self, host):
+        with self.lock:
+            bucket = self.hosts.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.host_rate, self.host_burst)
+                self.hosts[host] = bucket
+            return bucket
+
+    def acquire(self, host):
+        '''Wait for the host's back-off, its bucket and the global bucket'''
+        with self.lock:
+            backoff = self.backoff.get(host)
+        if backoff is not None:
+            wait = backoff[1] - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        self.host_bucket(host).acquire()
+        self.global_bucket.acquire()
+
+    def report(self, host, ok):
+        '''Record the outcome of a call, ok is False for timeouts and 5xx errors'''
+        bucket = self.global_bucket
+        with self.lock:
+            if ok:
+                if host in self.backoff:
+                    delay = self.backoff[host][0] / 2
+                    if delay < 1.0:
+                        del self.backoff[host]
+                    else:
+                        self.backoff[host] = (delay, 0.0)
+                if bucket.rate < self.rate:
+                    bucket.rate = min(self.rate, bucket.rate + self.rate / 100)
+                return
+            self.failures += 1
+            delay = 1.0
+            if host in self.backoff:
+                delay = min(MAX_BACKOFF, self.backoff[host][0] * 2)
+            self.backoff[host] = (delay, time.monotonic() + delay)
+            bucket.rate = max(self.rate * MIN_RATE_FACTOR, bucket.rate * 0.9)
+
+def limiter_from_argv(argv, workers):
+    '''Remove --rate and --host-rate (calls per second) from argv, return a RateLimiter or None
+
+    A limiter with the default rates is used whenever workers > 0.
+    Raises ValueError for a rate that is not a positive number.
+    '''
+    rates = {}
+    for name, keyword in (('--rate', 'rate'), ('--host-rate', 'host_rate')):
+        value = option_from_argv(argv, name, None)
+        if value is None:
+            continue
+        try:
+            rates[keyword] = float(value)
+        except ValueError:
+            rates[keyword] = 0.0
+        if rates[keyword] <= 0:
+            raise ValueError(name + " must be more than 0 calls per second")
+    if len(rates) == 0 and workers <= 0:
+        return None
+    return RateLimiter(**rates)
@@ -0,0 +1,98 @@
+'''Address resolution for port probes
+
+Literal IPv4/IPv6 addresses never touch DNS. Host names are looked up once,
+cached for TTL seconds and can be resolved ahead of time in the background.
+'''
+import ipaddress
+import socket
+import threading
+import time
+
+TTL = 300           # seconds a successful lookup is reused
+FAILED_TTL = 30     # seconds a failed lookup is remembered
+
+_cache = {}
+_pending = {}
+_lock = threading.Lock()
+_pool = None
+
+def split_host_port(address):
+    '''Split "host", "host:port", "[v6]:port" or a bare IPv6 address into (host, port or None)'''
+    if address.startswith("["):
+        host, _, rest = address[1:].partition("]")
+        if rest.startswith(":"):
+            return host, rest[1:]
+        return host, None
+    if address.count(":") > 1:
+        return address, None
+    host, _, port = address.partition(":")
+    if len(port) == 0:
+        return host, None
+    return host, port
+
+def join_host_port(host, port):
+    '''Inverse of split_host_port, IPv6 addresses get brackets'''
+    if ":" in host:
+        return "[" + host + "]:" + str(port)
+    return host + ":" + str(port)
+
+def literal(host):
+    '''Return (family, address) for a literal IP, None for a host name'''
+    try:
+        adr = ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    if adr.version == 6:
+        if adr.ipv4_mapped is not None:
+            return socket.AF_INET, str(adr.ipv4_mapped)
+        return socket.AF_INET6, str(adr)
+    return socket.AF_INET, str(adr)
+
+def _lookup(host):
+    '''Blocking lookup, returns (family, address) or the gaierror'''
+    try:
+        info = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except socket.gaierror as error:
+        result = error
+        expires = time.monotonic() + FAILED_TTL
+    else:
+        result = (info[0][0], info[0][4][0])
+        expires = time.monotonic() + TTL
+    with _lock:
+        _cache[host] = (expires, result)
+        _pending.pop(host, None)
+    return result
+
+def prefetch(hosts):
+    '''Start background lookups for the host names in hosts that are not cached'''
+    global _pool
+    now = time.monotonic()
+    with _lock:
+        for host in hosts:
+            if literal(host) is not None or host in _pending:
+                continue
+            entry = _cache.get(host)
+            if entry is not None and entry[0] > now:
+                continue
+            if _pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="resolver")
+            _pending[host] = _pool.submit(_lookup, host)
+
+def resolve(host):
+    '''Return (family, address) for host, raises socket.gaierror if it can not be resolved'''
+    found = literal(host)
+    if found is not None:
+        return found
+    with _lock:
+        entry = _cache.get(host)
+        future = _pending.get(host)
+    if entry is not None and entry[0] > time.monotonic():
+        result = entry[1]
+    elif future is not None:
+        result = future.result()
+    else:
+        result = _lookup(host)
+    if isinstance(result, socket.gaierror):
+        raise result
+    return result
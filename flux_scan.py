@@ -0,0 +1,620 @@
+'''Scanning core shared by check_nodes.py and check_nodes_sql.py
+
+Results are passed to a sink (see flux_sinks.py) so the same scan can be
+stored as CSV, in MySQL, as JSON lines or just printed.
+'''
+import ipaddress
+import json
+import os
+import signal
+import socket
+import sys
+import time
+import zlib
+from datetime import datetime
+import flux_resolver
+from flux_options import option_from_argv
+from flux_sinks import BufferSink
+from flux_progress import ProgressSink
+
+API_URL = "https://api.runonflux.io/"
+LOCAL_NODES_FILE = "local_nodes.py"
+
+max_nodes = 0
+num_nodes = 0
+num_checked = 0
+num_good = 0
+flux_cache = None   # FluxCache set by the CLI, see flux_cache.cache_from_argv
+active_sink = None  # sink of the running check_nodes, flushed by handler()
+rate_limiter = None # RateLimiter set by the CLI, see flux_ratelimit.limiter_from_argv
+progress = None     # Progress set by the CLI, see flux_progress.progress_from_argv
+max_in_flight = 0   # nodes checked or waiting to be stored at once, 0 is twice the workers
+archive = None      # Archive set by the CLI, see flux_archive.archive_from_argv
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S "  # console log time, check_nodes.py uses "%b-%d-%Y %H:%M:%S "
+
+def load_local_nodes(filename):
+    '''Read the local_nodes dict (public ip:port -> LAN ip:port) if the file exists'''
+    if not os.path.exists(filename):
+        return {}
+    scope = {}
+    with open(filename, encoding="utf-8") as file:
+        exec(file.read(), scope)  # pylint: disable=W0122
+    return scope.get("local_nodes", {})
+
+local_nodes = load_local_nodes(LOCAL_NODES_FILE)
+
+def terminated(signum, frame):
+    '''SIGTERM handler, exit through the normal path so sinks are closed and atexit hooks run'''
+    sys.exit(128 + signum)
+
+def setup_from_argv(argv):
+    '''Remove the scan options from argv and configure this module, returns (sinks, workers)
+
+    Prints the problem and exits if an output or the progress port can not be opened.
+    '''
+    global flux_cache, rate_limiter, progress, max_in_flight, archive
+    # run_shards stops its workers with SIGTERM
+    signal.signal(signal.SIGTERM, terminated)
+    from flux_archive import archive_from_argv
+    from flux_cache import cache_from_argv
+    from flux_ratelimit import limiter_from_argv
+    from flux_progress import progress_from_argv
+    from flux_sinks import sinks_from_argv
+    flux_cache = cache_from_argv(argv)
+    workers = option_from_argv(argv, "--workers", 0)
+    max_in_flight = option_from_argv(argv, "--max-in-flight", 0)
+    try:
+        rate_limiter = limiter_from_argv(argv, workers)
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+    try:
+        progress = progress_from_argv(argv)
+        archive = archive_from_argv(argv)
+        sinks = sinks_from_argv(argv)
+    except OSError as error:
+        if error.filename is None:
+            # --progress-port already in use
+            print("--progress-port failed:", error)
+        else:
+            print("Open of ", error.filename, " failed")
+        sys.exit(1)
+    except (RuntimeError, ValueError) as error:
+        print(error)
+        sys.exit(1)
+    return sinks, workers
+
+def handler(signum, frame):
+    '''SIGINT handler, print progress and ask before exiting'''
+    print("Checked ", num_checked, " of ", num_nodes, "/", max_nodes, " and ", num_good, " had no errors")
+    if active_sink is not None:
+        active_sink.flush()
+    msg = "Ctrl-c was pressed. Do you really want to exit? y/n "
+    print(msg, end="", flush=True)
+    res = sys.stdin.read(1)
+    if res == 'y':
+        print("")
+        raise KeyboardInterrupt
+    print("", end="\r", flush=True)
+    print(" " * len(msg), end="", flush=True) # clear the printed line
+    print("    ", end="\r", flush=True)
+
+def timestamp():
+    cur_time = datetime.now()
+    now = cur_time.strftime(TIME_FORMAT)
+    return now
+
+def logmsg(msg):
+    '''Format message with date and time'''
+    return timestamp()+msg
+
+def non_routable_ip(ip_adr):
+    '''True for a private or link local IPv4 or IPv6 address (IPv4 mapped addresses included)
+
+    Peers may carry a port, names that are not addresses count as routable.
+    '''
+    host, _ = flux_resolver.split_host_port(ip_adr)
+    try:
+        adr = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    if adr.version == 6 and adr.ipv4_mapped is not None:
+        adr = adr.ipv4_mapped
+    # Link Local does not make sense in a networkin environment
+    return adr.is_private or adr.is_link_local
+
+def get_node_ip_or_local(the_node):
+    '''Return the address to probe for a node, mapped through local_nodes'''
+    if the_node in local_nodes:
+        the_node = local_nodes[the_node]
+    node_ip, _ = flux_resolver.split_host_port(the_node)
+    return node_ip
+
+def get_api(path, timeout=10):
+    '''Call the central Flux API, return data or None (printing the error)'''
+    if archive is None:
+        return fetch_api(path, timeout)
+    if archive.replaying:
+        return archive.api(path)
+    data = fetch_api(path, timeout)
+    archive.record_api(path, data)
+    return data
+
+def fetch_api(path, timeout=10):
+    '''get_api from the network'''
+    import requests
+    url = API_URL + path
+    try:
+        req = requests.get(url, timeout=timeout)
+    except requests.RequestException as error:
+        print("Error", url, error)
+        return None
+    if req.status_code != 200:
+        print("Error", url, "Status", req.status_code)
+        return None
+    values = json.loads(req.text)
+    if values["status"] != "success":
+        print(values)
+        return None
+    return values["data"]
+
+def get_node_list(filter):
+    '''Return the deterministic node list, optionally filtered'''
+    return get_api("daemon/viewdeterministiczelnodelist/" + filter, timeout=60)
+
+def get_flux(the_node, path):
+    '''Call flux API'''
+    if len(the_node) == 0:
+        the_node = "api.runonflux.io"
+    else:
+        host, port = flux_resolver.split_host_port(the_node)
+        if port is None:
+            the_node = flux_resolver.join_host_port(host, 16127)
+    if the_node in local_nodes:
+        the_node = local_nodes[the_node]
+    if archive is None:
+        return fetch_flux(the_node, path)
+    if archive.replaying:
+        return archive.flux(the_node, path)
+    ret_data = fetch_flux(the_node, path)
+    archive.record_flux(the_node, path, ret_data)
+    return ret_data
+
+def fetch_flux(the_node, path):
+    '''get_flux for a node address already mapped through local_nodes, from the cache or network'''
+    if flux_cache is not None:
+        hit, cached = flux_cache.lookup(the_node, path)
+        if hit:
+            return cached
+    import requests
+    url = "http://" + the_node + "/" + path
+    host = flux_resolver.split_host_port(the_node)[0]
+    if rate_limiter is not None:
+        rate_limiter.acquire(host)
+    if progress is not None:
+        progress.request_started()
+    try:
+        req = requests.get(url, timeout=5)
+    except requests.RequestException as error:
+        # Refused connections and DNS errors mean a dead node, not an overloaded one
+        if rate_limiter is not None and isinstance(error, requests.Timeout):
+            rate_limiter.report(host, False)
+        return None
+    finally:
+        if progress is not None:
+            progress.request_finished()
+    if rate_limiter is not None:
+        rate_limiter.report(host, req.status_code < 500)
+    # Get the list of nodes where our app is deplolyed
+    ret_data = None
+    if req.status_code == 200:
+        try:
+            values = json.loads(req.text)
+            if values["status"] == "success":
+                # json looks good and status correct, iterate through node list
+                ret_data = values["data"]
+        except (ValueError, KeyError, TypeError):
+            ret_data = None
+    if flux_cache is not None:
+        flux_cache.store(the_node, path, ret_data)
+    return ret_data
+
+def node_connection(port, appip):
+    '''Open socket to Node'''
+    try:
+        family, remote_ip = flux_resolver.resolve(appip)
+    except socket.gaierror:
+        return 'Hostname could not be resolved'
+
+    try:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+    except socket.error:
+        return 'Failed to create socket'
+
+    # Set short timeout
+    sock.settimeout(30)
+
+    # Connect to remote server
+    try:
+        error = None
+        sock.connect((remote_ip , port))
+    except ConnectionRefusedError:
+        error = "Refused"
+        sock.close()
+        sock = None
+    except TimeoutError:
+        error = "TimeoutError"
+        sock.close()
+        sock = None
+    except socket.error:
+        error = "NoRoute"
+        sock.close()
+        sock = None
+
+    if sock is None:
+        return error
+
+    # Set longer timeout
+    sock.settimeout(60)
+    return sock
+
+def public_tcp_ports(app):
+    '''Return the public TCP ports of a running app'''
+    ports = []
+    for port in app["Ports"]:
+        if "IP" in port and port["IP"] == "0.0.0.0" and port["Type"] == "tcp":
+            ports.append(port["PublicPort"])
+    return ports
+
+def probe_port(node_ip, port):
+    '''Try to connect to a port, return (result, milliseconds)'''
+    if archive is None:
+        return connect_port(node_ip, port)
+    if archive.replaying:
+        return archive.probe(node_ip, port)
+    result, ms = connect_port(node_ip, port)
+    archive.record_probe(node_ip, port, result, ms)
+    return result, ms
+
+def connect_port(node_ip, port):
+    '''probe_port over the network'''
+    if rate_limiter is not None:
+        rate_limiter.acquire(node_ip)
+    if progress is not None:
+        progress.request_started()
+    start = time.monotonic()
+    sock = node_connection(port, node_ip)
+    ms = round((time.monotonic() - start) * 1000)
+    if progress is not None:
+        progress.request_finished()
+    if rate_limiter is not None:
+        rate_limiter.report(node_ip, sock != "TimeoutError")
+    if isinstance(sock, str):
+        return sock, ms
+    sock.close()
+    return "OK", ms
+
+def app_instance(this_node, app_name):
+    '''Get node status and the matching containers for one instance of an app
+
+    Returns a dict with ip, status, tier and apps (name, state, status, ports)
+    '''
+    instance = {'ip': this_node['ip'], 'status': "FAILED", 'tier': "", 'apps': []}
+    data = get_flux(this_node['ip'], "daemon/getzelnodestatus")
+    if data is None:
+        instance['status'] = "noapiport"
+        return instance
+    instance['status'] = data['status']
+    if data['status'] == "CONFIRMED":
+        instance['tier'] = data['tier']
+    else:
+        instance['tier'] = "none"
+    data = get_flux(this_node['ip'], "apps/listrunningapps")
+    if data is None:
+        instance['status'] = "nolistapps"
+        return instance
+    for app in data:
+        if app["Names"][0].startswith("/flux") and app["Names"][0].endswith("_" + app_name):
+            instance['apps'].append((app["Names"][0], app["State"], app["Status"], public_tcp_ports(app)))
+    return instance
+
+def check_app(app_name, workers=0):
+    '''Check all running instances and see if we can reach the app
+
+    With workers > 0 the instances and their ports are checked concurrently
+    and a table sorted by node is printed at the end.
+    '''
+    nodes = get_api("apps/location/" + app_name)
+    if nodes is None:
+        return
+    flux_resolver.prefetch([get_node_ip_or_local(this_node['ip']) for this_node in nodes])
+    if workers > 0:
+        check_app_concurrent(app_name, nodes, workers)
+        return
+    for this_node in nodes:
+        instance = app_instance(this_node, app_name)
+        print(instance['ip'] + " " + instance['status'] + " " + instance['tier'])
+        node_ip = get_node_ip_or_local(this_node['ip'])
+        for name, state, status, ports in instance['apps']:
+            app_state = name + " State " + state + " Status " + status + " "
+            for port in ports:
+                result, ms = probe_port(node_ip, port)
+                app_state += str(port) + " " + result + " "
+            print(" App: " + app_state)
+
+def check_app_concurrent(app_name, nodes, workers):
+    '''Fan out over all instances, then over all their ports, and print a table'''
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        instances = list(pool.map(lambda this_node: app_instance(this_node, app_name), nodes))
+        probes = []
+        for instance in instances:
+            node_ip = get_node_ip_or_local(instance['ip'])
+            for name, state, status, ports in instance['apps']:
+                for port in ports:
+                    probes.append((instance, name, state, port, pool.submit(probe_port, node_ip, port)))
+    rows = []
+    for instance in instances:
+        if len(instance['apps']) == 0:
+            rows.append((instance['ip'], instance['status'], instance['tier'], "", "", "", "", ""))
+        for name, state, status, ports in instance['apps']:
+            if len(ports) == 0:
+                rows.append((instance['ip'], instance['status'], instance['tier'], name, state, "", "", ""))
+    for instance, name, state, port, future in probes:
+        result, ms = future.result()
+        rows.append((instance['ip'], instance['status'], instance['tier'], name, state, str(port), result, str(ms)))
+    rows.sort(key=lambda row: (row[0], row[3], int(row[5] or 0)))
+    line = "%-22s %-10s %-8s %-28s %-8s %6s %-12s %6s"
+    print(line % ("Node", "Status", "Tier", "App", "State", "Port", "Result", "ms"))
+    good = 0
+    for row in rows:
+        print(line % row)
+        if row[6] == "OK":
+            good += 1
+    print("Summary: ", len(nodes), " instances, ", len(probes), " ports probed, ", good, " reachable")
+
+def peers_routable(this_node, status, tier, sink):
+    '''Check connected and incoming peers, record the failure and return False if any'''
+    data = get_flux(this_node['ip'], "flux/connectedpeers")
+    if data is None:
+        print(logmsg(this_node["ip"] + " " + status + " " + tier + " FAILED get connected peers"))
+        sink.add(this_node, "getpeersfailed", 10, tier + "API Port usable but request failed", tier)
+        return False
+    for peer in data:
+        if non_routable_ip(peer):
+            print(logmsg(this_node["ip"] + " " + status + " " + tier + " non routable peer " + peer))
+            sink.add(this_node, "nonroutablepeer", 20, tier + " Found a peer with Private IP", tier)
+            return False
+    data = get_flux(this_node['ip'], "flux/incomingconnections")
+    if data is None:
+        print(logmsg(this_node["ip"] + " " + status + " " + tier + " FAILED get incoming connection"))
+        sink.add(this_node, "incomingfailed", 21, tier + " API Port usable but request failed", tier)
+        return False
+    for peer in data:
+        if non_routable_ip(peer):
+            print(logmsg(this_node["ip"] + " " + status + " " + tier + " non routable incoming " + peer))
+            sink.add(this_node, "nonroutableincoming", 22, tier + " Found incoming connection with Private IP", tier)
+            return False
+    return True
+
+def check_node(this_node, sink):
+    '''Check one node and record the results, returns (checked, good) app counts'''
+    checked = 0
+    good = 0
+    data = get_flux(this_node['ip'], "daemon/getzelnodestatus")
+    if data is None:
+        print(logmsg(this_node["ip"] + " API Port FAILED"))
+        sink.add(this_node, "noapiport", 0, "API Port unreachable")
+        return checked, good
+    status = data['status']
+    if status == "CONFIRMED":
+        tier = data['tier']
+    else:
+        tier = "none"
+    if not peers_routable(this_node, status, tier, sink):
+        return checked, good
+    data = get_flux(this_node['ip'], "apps/listrunningapps")
+    if data is None:
+        print(logmsg(this_node["ip"] + " " + status + " " + tier + " FAILED get running apps"))
+        sink.add(this_node, "nolistapps", 50, tier + " App list returned NONE - Error?", tier)
+        return checked, good
+    for app in data:
+        app_name = app["Names"][0]
+        ports = public_tcp_ports(app)
+        if len(ports) == 0:
+            sink.add(this_node, status, 100, tier + " " + app_name, tier, app_name)
+            continue
+        found_error = False
+        any_good = False
+        node_ip = get_node_ip_or_local(this_node["ip"])
+        for port in ports:
+            sport = str(port)
+            result, ms = probe_port(node_ip, port)
+            if result != "OK":
+                found_error = True
+                sink.add(this_node, status, 100, tier + " " + app_name + " " + sport + " Error: " + result,
+                    tier, app_name, sport, result)
+            else:
+                any_good = True
+                sink.add(this_node, status, 100, tier + " " + app_name + " " + sport + " OK",
+                    tier, app_name, sport, "OK")
+        checked += 1
+        if not found_error:
+            good += 1
+        if not any_good:
+            print(logmsg(this_node['ip'] + " " + status + " " + tier + " All Ports " + str(len(ports)) + " failed"))
+    return checked, good
+
+def parse_shard(text):
+    '''Parse "i/N" into (i, N), raises ValueError if it is not a valid shard'''
+    index, _, count = text.partition("/")
+    index = int(index)
+    count = int(count)
+    if count < 1 or index < 0 or index >= count:
+        raise ValueError("shard must be i/N with 0 <= i < N")
+    return index, count
+
+def shard_from_argv(argv):
+    '''Remove --shard i/N from argv and return (i, N) or None, exits on a bad value'''
+    shard = option_from_argv(argv, "--shard", None)
+    if shard is None:
+        return None
+    try:
+        return parse_shard(shard)
+    except ValueError:
+        print("--shard must be i/N with 0 <= i < N, not", shard)
+        sys.exit(1)
+
+def in_shard(this_node, shard):
+    '''True if this_node belongs to shard (i, N), nodes are split by collateral hash'''
+    index, count = shard
+    return zlib.crc32(str(this_node["collateral"]).encode()) % count == index
+
+def shard_name(name, index):
+    '''Give each shard its own output file, scan.csv.gz -> scan.2.csv.gz'''
+    head, tail = os.path.split(name)
+    base, dot, ext = tail.partition(".")
+    return os.path.join(head, base + "." + str(index) + dot + ext)
+
+def run_shards(argv, count):
+    '''Coordinator, run the script in argv as count worker processes with --shard i/count
+
+    CSV, JSON lines, event log, profile, recording and cache files get a per shard name, databases are shared.
+    Each worker serves its progress on its own port, the coordinator shows
+    and serves the total for --progress and --progress-port. Each worker
+    gets an equal share of --rate, or of the default rate whenever the
+    workers would use a rate limiter.
+    Returns the worst exit code of the workers.
+    '''
+    import subprocess
+    from flux_progress import shard_progress_from_argv
+    from flux_ratelimit import DEFAULT_RATE
+    argv = list(argv)
+    shard_progress, ports = shard_progress_from_argv(argv, count)
+    # --rate is the budget of the whole run, split it between the workers. Each
+    # node is in one shard only, so --host-rate needs no split.
+    rate = option_from_argv(argv, "--rate", None)
+    if rate is None and ("--workers" in argv or "--host-rate" in argv):
+        rate = DEFAULT_RATE
+    if rate is not None:
+        try:
+            rate = str(float(rate) / count)
+        except ValueError:
+            pass # the workers report it
+    workers = []
+    for index in range(count):
+        args = list(argv)
+        for pos in range(len(args) - 1):
+            if args[pos] in ("--csv", "--jsonl", "--events", "--profile", "--record", "--cache-file") and args[pos + 1] != "-":
+                args[pos + 1] = shard_name(args[pos + 1], index)
+        args += ["--shard", str(index) + "/" + str(count)]
+        if len(ports) > 0:
+            args += ["--progress-port", str(ports[index])]
+        if rate is not None:
+            args += ["--rate", rate]
+        # New session so Ctrl-C only reaches the coordinator
+        workers.append(subprocess.Popen([sys.executable] + args, stdin=subprocess.DEVNULL, start_new_session=True))
+    try:
+        return max(worker.wait() for worker in workers)
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.wait()
+        raise
+    finally:
+        if shard_progress is not None:
+            shard_progress.stop()
+
+def check_node_logged(this_node, sink):
+    '''check_node, an unexpected error (a malformed reply) is logged and recorded as a checkerror row
+
+    One bad node must not end a sweep of thousands.
+    '''
+    try:
+        return check_node(this_node, sink)
+    except Exception as error: # pylint: disable=W0703
+        print(logmsg(this_node["ip"] + " check failed " + repr(error)))
+        sink.add(this_node, "checkerror", 0, "Check failed: " + repr(error)[:200])
+        return 0, 0
+
+def check_node_buffered(this_node):
+    '''check_node for a worker thread, results are kept for the main thread to store'''
+    buffer = BufferSink()
+    checked, good = check_node_logged(this_node, buffer)
+    return buffer, checked, good
+
+def bounded_map(pool, func, items, limit):
+    '''Like pool.map but with at most limit items submitted and not yet consumed
+
+    Items are only taken from the iterable as results are consumed, so a slow
+    consumer holds the producers back instead of letting results pile up.
+    '''
+    from collections import deque
+    futures = deque()
+    for item in items:
+        if len(futures) >= limit:
+            yield futures.popleft().result()
+        futures.append(pool.submit(func, item))
+    while len(futures) > 0:
+        yield futures.popleft().result()
+
+def slim_nodes(nodes):
+    '''Yield just the collateral and ip of each node, dropping the decoded entries as it goes'''
+    nodes.reverse()
+    while len(nodes) > 0:
+        this_node = nodes.pop()
+        yield {'collateral': this_node['collateral'], 'ip': this_node['ip']}
+
+def check_nodes(filter, sink, workers=0, shard=None):
+    '''Check all nodes matching filter and send the results to sink
+
+    With workers > 0 that many nodes are checked at a time, the results are
+    still written to the sink in node list order from this thread. No more
+    than max_in_flight nodes are being checked or waiting for the sink.
+    With shard (i, N) only the i'th of N deterministic slices of the list is checked.
+    '''
+    global max_nodes, num_checked, num_good, num_nodes, active_sink
+    nodes = get_node_list(filter)
+    if nodes is None:
+        sink.close()
+        return
+    if shard is not None:
+        nodes = [this_node for this_node in nodes if in_shard(this_node, shard)]
+    flux_resolver.prefetch([get_node_ip_or_local(this_node['ip']) for this_node in nodes])
+    max_nodes = len(nodes)
+    nodes = slim_nodes(nodes)
+    num_nodes = 0
+    num_checked = 0
+    num_good = 0
+    active_sink = sink
+    if progress is not None:
+        progress.begin(max_nodes, sink)
+        sink = ProgressSink(sink, progress)
+    try:
+        if workers > 0:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                limit = max_in_flight if max_in_flight > 0 else workers * 2
+                for buffer, checked, good in bounded_map(pool, check_node_buffered, nodes, limit):
+                    num_nodes += 1
+                    buffer.replay(sink)
+                    num_checked += checked
+                    num_good += good
+                    if progress is not None:
+                        progress.node_done()
+        else:
+            for this_node in nodes:
+                sys.stdout.flush()
+                num_nodes += 1
+                checked, good = check_node_logged(this_node, sink)
+                num_checked += checked
+                num_good += good
+                if progress is not None:
+                    progress.node_done()
+        if progress is not None:
+            progress.stop()
+        print("Summary: ", num_nodes, " found, ", num_checked, " nodes checked, ", num_good, " found with no issues")
+    finally:
+        active_sink = None
+        sink.close()
@@ -0,0 +1,272 @@
+'''Result sinks for flux_scan.check_nodes
+
+A sink receives one call to add() per result and close() at the end of the scan.
+'''
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+from flux_resolver import split_host_port
+from flux_options import option_from_argv
+
+class ResultSink:
+    '''Base sink, discards everything'''
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        '''Record one result for this_node (dict with 'ip' and 'collateral')'''
+
+    def pending(self):
+        '''Number of results buffered but not yet written'''
+        return 0
+
+    def flush(self):
+        '''Write out anything buffered, called from the SIGINT handler'''
+
+    def close(self):
+        '''Flush and release the sink'''
+
+# Port probe errors as check_nodes.py wrote them to the CSV status column, after the address
+CSV_PROBE_ERRORS = {
+    "Refused": " connection refused",
+    "TimeoutError": " Connect TimeoutError",
+    "NoRoute": " No route to host",
+}
+
+class CsvSink(ResultSink):
+    '''Append results to a CSV file, gzip compressed if the name ends in .gz
+
+    Rows are buffered and written to disk every flush_interval seconds.
+    '''
+    # CSV Format
+    # Timestamp, NodeIP, Status (CONFIRMED, expired, noapiport), Tier, App, port, status
+    def __init__(self, filename, flush_interval=5):
+        if filename.endswith(".gz"):
+            import gzip
+            self.file = gzip.open(filename, "at", encoding="utf-8", newline="")
+        else:
+            self.file = open(filename, "a", encoding="utf-8", newline="", buffering=1024*1024)
+        self.writer = csv.writer(self.file, lineterminator="\n")
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        self.stamp_second = 0
+        self.stamp = ""
+
+    def timestamp(self):
+        '''Formatted time, only reformatted when the second changes'''
+        second = int(time.time())
+        if second != self.stamp_second:
+            self.stamp_second = second
+            self.stamp = datetime.fromtimestamp(second).strftime("%b-%d-%Y %H:%M:%S ")
+        return self.stamp
+
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        if status in CSV_PROBE_ERRORS:
+            status = split_host_port(this_node["ip"])[0] + CSV_PROBE_ERRORS[status]
+        self.writer.writerow((self.timestamp(), this_node["ip"], nstatus, tier, app, port, status))
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.file.close()
+
+class DbSink(ResultSink):
+    '''Insert results into node_status through a flux_db.NodeStatusDb, batch_size rows per transaction'''
+    def __init__(self, store, batch_size=500):
+        self.store = store
+        self.batch_size = batch_size
+        self.rows = []
+
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        self.rows.append((str(this_node["collateral"]), this_node["ip"], nstatus, health, comment))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def pending(self):
+        '''Number of rows waiting for the next transaction'''
+        return len(self.rows)
+
+    def flush(self):
+        if len(self.rows) > 0:
+            self.store.insert(self.rows)
+            self.rows = []
+
+    def close(self):
+        self.flush()
+        self.store.close()
+
+class JsonLinesSink(ResultSink):
+    '''Write one JSON object per result, filename '-' is stdout'''
+    def __init__(self, filename):
+        if filename == "-":
+            self.file = sys.stdout
+        else:
+            self.file = open(filename, "a", encoding="utf-8")
+
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        result = {'time': datetime.now().isoformat(timespec="seconds"), 'node_hash': this_node.get("collateral"),
+            'node_ip': this_node["ip"], 'node_state': nstatus, 'node_health': health, 'tier': tier,
+            'app': app, 'port': port, 'status': status, 'comment': comment}
+        self.file.write(json.dumps(result) + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.file is sys.stdout:
+            self.file.flush()
+        else:
+            self.file.close()
+
+class ParquetSink(ResultSink):
+    '''Buffer results and write compressed Parquet files partitioned by day
+
+    A day is written once a row for a later day arrives (rows come in time
+    order) or it reaches rows_per_file rows, so only about a day is held.
+    Files are written as directory/date=YYYY-MM-DD/part-<time>-<pid>.parquet
+    with the repetitive string columns dictionary encoded. Needs pyarrow.
+    '''
+    COLUMNS = ("time", "node_hash", "node_ip", "node_state", "node_health", "tier", "app", "port", "status", "comment")
+    DICT_COLUMNS = ("node_hash", "node_ip", "node_state", "tier", "app", "port", "status")
+
+    def __init__(self, directory, rows_per_file=100000, compression="zstd"):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as error:
+            raise RuntimeError("Parquet output needs pyarrow, pip3 install pyarrow") from error
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = directory
+        self.rows_per_file = rows_per_file
+        self.compression = compression
+        self.parts = 0
+        self.days = {}
+
+    def add_row(self, when, node_hash, node_ip, nstatus, health, tier="", app="", port="", status="", comment=""):
+        '''Buffer one row, when is a datetime'''
+        day = when.strftime("%Y-%m-%d")
+        if day not in self.days:
+            # Rows arrive in time order, so earlier days are complete
+            self.write_older_than(day)
+            self.days[day] = {name: [] for name in self.COLUMNS}
+        columns = self.days[day]
+        for name, value in zip(self.COLUMNS, (when, node_hash, node_ip, nstatus, health, tier, app, port, status, comment)):
+            columns[name].append(value)
+        if len(columns["time"]) >= self.rows_per_file:
+            self.write_day(day)
+
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        self.add_row(datetime.now(), this_node.get("collateral"), this_node["ip"], nstatus, health,
+            tier, app, port, status, comment)
+
+    def pending(self):
+        '''Number of buffered rows not yet written'''
+        return sum(len(columns["time"]) for columns in self.days.values())
+
+    def write_day(self, day):
+        '''Write the buffered rows for one day as a new part file'''
+        pa = self.pa
+        columns = self.days.pop(day)
+        arrays = []
+        for name in self.COLUMNS:
+            if name == "time":
+                arrays.append(pa.array(columns[name], type=pa.timestamp("s")))
+            elif name == "node_health":
+                arrays.append(pa.array(columns[name], type=pa.int8()))
+            elif name in self.DICT_COLUMNS:
+                arrays.append(pa.array(columns[name], type=pa.string()).dictionary_encode())
+            else:
+                arrays.append(pa.array(columns[name], type=pa.string()))
+        table = pa.Table.from_arrays(arrays, names=list(self.COLUMNS))
+        part_dir = os.path.join(self.directory, "date=" + day)
+        os.makedirs(part_dir, exist_ok=True)
+        self.parts += 1
+        name = "part-%s-%d-%d.parquet" % (datetime.now().strftime("%H%M%S"), os.getpid(), self.parts)
+        self.pq.write_table(table, os.path.join(part_dir, name), compression=self.compression,
+            use_dictionary=list(self.DICT_COLUMNS))
+
+    def write_older_than(self, day):
+        '''Write the buffered rows of every day before day ("YYYY-MM-DD")'''
+        for older in [older for older in self.days if older < day]:
+            self.write_day(older)
+
+    def close(self):
+        for day in list(self.days):
+            self.write_day(day)
+
+class StdoutSink(ResultSink):
+    '''Print every result'''
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S ")
+        print(now + this_node["ip"] + " " + nstatus + " " + str(health) + " " + comment)
+
+class BufferSink(ResultSink):
+    '''Keep results in memory until replay() passes them to another sink'''
+    def __init__(self):
+        self.rows = []
+
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        self.rows.append((this_node, nstatus, health, comment, tier, app, port, status))
+
+    def replay(self, sink):
+        '''Send the kept results to sink'''
+        for row in self.rows:
+            sink.add(*row)
+        self.rows = []
+
+class MultiSink(ResultSink):
+    '''Send every result to several sinks'''
+    def __init__(self, sinks):
+        self.sinks = sinks
+
+    def add(self, this_node, nstatus, health, comment, tier="", app="", port="", status=""):
+        for sink in self.sinks:
+            sink.add(this_node, nstatus, health, comment, tier, app, port, status)
+
+    def pending(self):
+        return sum(sink.pending() for sink in self.sinks)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+def sinks_from_argv(argv):
+    '''Remove --csv name, --jsonl name, --parquet dir, --stdout and --flush-interval secs
+    from argv, return the sinks they select'''
+    sinks = []
+    flush_interval = option_from_argv(argv, "--flush-interval", 5.0)
+    for option in ("--csv", "--jsonl", "--parquet"):
+        while option in argv:
+            pos = argv.index(option)
+            if len(argv) <= pos + 1:
+                del argv[pos]
+                continue
+            name = argv[pos + 1]
+            del argv[pos:pos + 2]
+            if option == "--csv":
+                sinks.append(CsvSink(name, flush_interval))
+            elif option == "--parquet":
+                sinks.append(ParquetSink(name))
+            else:
+                sinks.append(JsonLinesSink(name))
+    if "--stdout" in argv:
+        argv.remove("--stdout")
+        sinks.append(StdoutSink())
+    return sinks
+
+def make_sink(sinks):
+    '''Combine a list of sinks into one'''
+    if len(sinks) == 0:
+        return ResultSink()
+    if len(sinks) == 1:
+        return sinks[0]
+    return MultiSink(sinks)
@@ -1,9 +1,8 @@
 #!/usr/bin/python3
 '''This module is a single file that supports the loading of secrets into a Flux Node'''
+import atexit
 import json
 import sys
-import requests
-from fluxvault import FluxAgent
 from datetime import datetime
 
 VAULT_NAME = "home.moulton.us"                    # EDIT ME
@@ -11,6 +10,7 @@ FILE_DIR = "./files/"   # EDIT ME
 VAULT_PORT = 39289                                # EDIT ME
 APP_NAME = "p1"                            # EDIT ME
 VERBOSE = False
+flux_cache = None
 
 def logmsg(msg):
     '''Format message with date and time'''
@@ -40,6 +40,7 @@ def dump_report():
 
 def get_public_ip():
     '''Get public ip or return None'''
+    import requests
     url = "http://ifconfig.me/ip"
     req = requests.get(url)
     pub_ip = None
@@ -47,16 +48,23 @@ def get_public_ip():
         pub_ip = req.text
     return pub_ip
 
-def get_flux(the_node, path):
-    '''Call flux API'''
+def get_flux(the_node, path, session=None):
+    '''Call flux API, through session (a requests.Session) if given'''
     if len(the_node) == 0:
         the_node = "api.runonflux.io"
     else:
-        if len(the_node.split(":")) == 1:
-            the_node = the_node + ":16127"
+        from flux_resolver import split_host_port, join_host_port
+        host, port = split_host_port(the_node)
+        if port is None:
+            the_node = join_host_port(host, 16127)
+    if flux_cache is not None:
+        hit, cached = flux_cache.lookup(the_node, path)
+        if hit:
+            return cached
+    import requests
     url = "http://" + the_node + "/" + path
     try:
-        req = requests.get(url, timeout=10)
+        req = (session or requests).get(url, timeout=10)
     except:
         return None
     # Get the list of nodes where our app is deplolyed
@@ -69,25 +77,145 @@ def get_flux(the_node, path):
                 ret_data = values["data"]
         except:
             ret_data = None
+    if flux_cache is not None:
+        flux_cache.store(the_node, path, ret_data)
     return ret_data
 
-class MyFluxAgent(FluxAgent):
-    '''User class to allow easy configuration, see EDIT ME above'''
-    def __init__(self) -> None:
-        super().__init__()
-        self.vault_name = VAULT_NAME
-        self.file_dir = FILE_DIR
-        self.vault_port = VAULT_PORT
-        self.verbose = VERBOSE
+MyFluxAgent = None
+
+def agent_class():
+    '''Define MyFluxAgent on first use, fluxvault is only imported when a node is polled'''
+    global MyFluxAgent
+    if MyFluxAgent is None:
+        from fluxvault import FluxAgent
+
+        class MyFluxAgent(FluxAgent):
+            '''User class to allow easy configuration, see EDIT ME above'''
+            def __init__(self) -> None:
+                super().__init__()
+                self.vault_name = VAULT_NAME
+                self.file_dir = FILE_DIR
+                self.vault_port = VAULT_PORT
+                self.verbose = VERBOSE
+    return MyFluxAgent
+
+class NodeSession:
+    '''What is kept for a node between polling runs of a long lived vault
+
+    The vault address is resolved once. The requests.Session shares one HTTP
+    connection between the calls of a run. Nodes close idle keep-alive
+    connections after a few seconds, so with a longer poll interval the
+    session reconnects on the next run, without any error. The FluxAgent
+    itself is still new for every connection, because its result and log
+    belong to that connection.
+    '''
+    def __init__(self, node):
+        import requests
+        import socket
+        self.node = node
+        self.session = requests.Session()
+        from flux_resolver import split_host_port
+        host = split_host_port(node)[0]
+        try:
+            self.address = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)[0][4][0]
+        except socket.gaierror:
+            self.address = host
+
+    def get_flux(self, path):
+        return get_flux(self.node, path, self.session)
+
+    def close(self):
+        self.session.close()
+
+node_sessions = {}  # node ip -> NodeSession, kept while the node runs our app
+api_session = None
+
+def node_session(node):
+    '''The NodeSession for node, created on first use'''
+    if node not in node_sessions:
+        node_sessions[node] = NodeSession(node)
+    return node_sessions[node]
+
+def drop_sessions(keep):
+    '''Close the sessions of nodes that are not in keep'''
+    for node in [node for node in node_sessions if node not in keep]:
+        node_sessions.pop(node).close()
+
+def poll_node(this_node, node_log):
+    '''Check one node running our app and load its secrets, updating its node_log entry'''
+    session = node_session(this_node['ip'])
+    data = session.get_flux("daemon/getzelnodestatus")
+    if data is None:
+        print(logmsg(this_node['ip'] + " get status failed"))
+        return
+    status = data.get('status', "")
+    tier = data.get('tier', "")
+    data = session.get_flux("apps/listrunningapps")
+    if data is None:
+        print(logmsg(this_node['ip'] + " get running apps failed"))
+        return
+    app_state = ""
+    for app in data:
+        if app["Names"][0] == "/fluxp1test_p1":
+            app_state += "Found " + app["Names"][0]
+            app_state += " State " + app["State"] + " Status " + app["Status"] + " "
+    print(logmsg(this_node['ip'] + " " + status + " " + tier + " " + app_state))
+    if this_node['ip'] in node_log:
+        mylog = node_log[this_node['ip']]
+        mylog['active'] = 1
+    else:
+        if VERBOSE:
+            print("New Node " + this_node['ip'])
+        msg = logmsg("New Instance " + this_node['ip'])
+        mylog = { 'log': [msg], 'min':999999999, 'max':0, 'avg':0,
+            'active':1, 'reported':0 }
+    start = datetime.now()
+    agent = agent_class()() # Each connection to a node get a fresh agent
+    ipadr = session.address
+    if VERBOSE:
+        print(this_node['name'], ipadr)
+    agent.node_vault_ip(ipadr)
+    dt = datetime.now() - start
+    ms = round(dt.microseconds/1000)+dt.seconds*1000
+    if VERBOSE:
+        print(ms, " ms")
+        print(this_node['name'], ipadr, agent.result)
+    if 'min' not in mylog:
+        mylog['min'] = mylog['max'] = mylog['avg'] = 0
+    if ms < mylog['min']:
+        mylog['min'] = ms
+    if ms > mylog['max']:
+        mylog['max'] = ms
+    if mylog['avg'] == 0:
+        mylog['avg'] = ms
+    else:
+        # Smoothed average 7/8 of average plus 1/8 new sample
+        mylog['avg'] = round(mylog['avg'] - (mylog['avg']/8) + (ms/8))
+    mylog['log'] += agent.log
+    node_log[this_node['ip']] = mylog
+    for log in agent.log:
+        print(log)
 
 def node_vault():
     '''Vault runs this to poll every Flux node running their app'''
+    global api_session
+    import requests
+    if api_session is None:
+        api_session = requests.Session()
     url = "https://api.runonflux.io/apps/location/" + APP_NAME
-    req = requests.get(url, timeout=10)
+    try:
+        req = api_session.get(url, timeout=10)
+    except requests.RequestException as error:
+        print("Error", url, error)
+        return
     # Get the list of nodes where our app is deplolyed
     if req.status_code == 200:
-        values = json.loads(req.text)
-        if values["status"] == "success":
+        try:
+            values = json.loads(req.text)
+        except ValueError:
+            print("Error", url, "bad JSON")
+            return
+        if values.get("status") == "success":
             # json looks good and status correct, iterate through node list
             nodes = values["data"]
             try:
@@ -100,58 +228,13 @@ def node_vault():
             for ip in node_log.keys():
                 node_log[ip]['active'] = 0
 
+            drop_sessions([this_node['ip'] for this_node in nodes])
             for this_node in nodes:
-                data = get_flux(this_node['ip'], "daemon/getzelnodestatus")
-                if data is None:
-                    print(logmsg(this_node['ip'] + " get status failed"))
-                    continue
-                status = data['status']
-                tier = data['tier']
-                data = get_flux(this_node['ip'], "apps/listrunningapps")
-                if data is None:
-                    print(logmsg(this_node['ip'] + " get running apps failed"))
-                    continue
-                app_state = ""
-                for app in data:
-                    if app["Names"][0] == "/fluxp1test_p1":
-                        app_state += "Found " + app["Names"][0]
-                        app_state += " State " + app["State"] + " Status " + app["Status"] + " "
-                print(logmsg(this_node['ip'] + " " + status + " " + tier + " " + app_state))
-                if this_node['ip'] in node_log:
-                    mylog = node_log[this_node['ip']]
-                    mylog['active'] = 1
-                else:
-                    if VERBOSE:
-                        print("New Node " + this_node['ip'])
-                    msg = logmsg("New Instance " + this_node['ip'])
-                    mylog = { 'log': [msg], 'min':999999999, 'max':0, 'avg':0,
-                        'active':1, 'reported':0 }
-                start = datetime.now()
-                agent = MyFluxAgent() # Each connection to a node get a fresh agent
-                ipadr = this_node['ip'].split(':')[0]
-                if VERBOSE:
-                    print(this_node['name'], ipadr)
-                agent.node_vault_ip(ipadr)
-                dt = datetime.now() - start
-                ms = round(dt.microseconds/1000)+dt.seconds*1000
-                if VERBOSE:
-                    print(ms, " ms")
-                    print(this_node['name'], ipadr, agent.result)
-                if 'min' not in mylog:
-                    mylog['min'] = mylog['max'] = mylog['avg'] = 0
-                if ms < mylog['min']:
-                    mylog['min'] = ms
-                if ms > mylog['max']:
-                    mylog['max'] = ms
-                if mylog['avg'] == 0:
-                    mylog['avg'] = ms
-                else:
-                    # Smoothed average 7/8 of average plus 1/8 new sample
-                    mylog['avg'] = round(mylog['avg'] - (mylog['avg']/8) + (ms/8))
-                mylog['log'] += agent.log
-                node_log[this_node['ip']] = mylog
-                for log in agent.log:
-                    print(log)
+                try:
+                    poll_node(this_node, node_log)
+                except Exception as error: # pylint: disable=W0703
+                    # fluxvault or a bad answer from one node must not stop the vault
+                    print(logmsg(this_node['ip'] + " poll failed " + repr(error)))
             if VERBOSE:
                 print("************************ REPORT *****************************")
             pop_nodes = []
@@ -179,40 +262,126 @@ def node_vault():
     else:
         print("Error", url, "Status", req.status_code)
 
-if __name__ == "__main__":
-    if len(sys.argv) == 1:
-        node_vault()
-        sys.exit(0)
-    if sys.argv[1].lower() == "--ip":
-        if len(sys.argv) > 2:
-            ipaddr = sys.argv[2]
-            one_node = MyFluxAgent()
-            one_node.node_vault_ip(ipaddr)
-            print(ipaddr, one_node.result)
-            sys.exit(0)
+CHECK_APPS = ("/fluxp1test_p1", "/fluxgammonbot_gammonbot")
+
+def check_node(node):
+    '''Status, tier and our apps on one node as a dict'''
+    result = {'node': node}
+    data = get_flux(node, "daemon/getzelnodestatus")
+    if data is None:
+        result['error'] = "get status failed"
+        return result
+    result['status'] = data.get('status')
+    result['tier'] = data.get('tier')
+    data = get_flux(node, "apps/listrunningapps")
+    if data is None:
+        result['error'] = "get running apps failed"
+        return result
+    result['apps'] = [{'name': app["Names"][0], 'state': app["State"], 'status': app["Status"]}
+        for app in data if app["Names"][0] in CHECK_APPS]
+    return result
+
+def vault_failed(result):
+    '''True if an agent.result says the node was not loaded'''
+    return not result or "fail" in str(result).lower() or "error" in str(result).lower()
+
+def vault_node(ipaddr):
+    '''Run the vault protocol against one node, returns a dict with the result'''
+    start = datetime.now()
+    from flux_resolver import split_host_port
+    agent = agent_class()()
+    agent.node_vault_ip(split_host_port(ipaddr)[0])
+    dt = datetime.now() - start
+    result = {'node': ipaddr, 'result': agent.result, 'ms': round(dt.total_seconds() * 1000)}
+    if vault_failed(agent.result):
+        result['error'] = "vault failed"
+    return result
+
+def node_address(word):
+    '''word if it is an ip, ip:port, IPv6 or [v6]:port address, otherwise None'''
+    import ipaddress
+    from flux_resolver import split_host_port
+    word = word.strip(",;()")
+    host, port = split_host_port(word)
+    try:
+        ipaddress.ip_address(host)
+    except ValueError:
+        return None
+    if port is not None and not port.isdigit():
+        return None
+    return word
+
+def read_nodes(names, from_file):
+    '''Nodes from the command line plus those in from_file ('-' is stdin)
+
+    Lines can be plain addresses or examine_db output, the first address
+    on a line is used and lines without one are skipped.
+    '''
+    nodes = list(names)
+    if from_file is not None:
+        if from_file == "-":
+            lines = sys.stdin.readlines()
         else:
-            print("Missing Node IP Address: --ip ipaddress")
-    if sys.argv[1].lower() == "--dump":
+            with open(from_file, encoding="utf-8") as file:
+                lines = file.readlines()
+        for line in lines:
+            if line.startswith("#"):
+                continue
+            for word in line.split():
+                found = node_address(word)
+                if found is not None:
+                    nodes.append(found)
+                    break
+    return nodes
+
+def run_batch(func, nodes, workers):
+    '''Call func for every node, workers at a time, printing one JSON line per node as it finishes'''
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = {pool.submit(func, node): node for node in nodes}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as error: # pylint: disable=W0703
+                result = {'node': futures[future], 'error': repr(error)}
+            if 'error' in result:
+                failed += 1
+            print(json.dumps(result, default=str), flush=True)
+    return failed
+
+def parse_args(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="With no arguments all nodes running " + APP_NAME + " are polled")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--ip", nargs="*", metavar="NODE", help="run the vault protocol against these nodes")
+    mode.add_argument("--check", nargs="*", metavar="NODE", help="report node status and our apps")
+    mode.add_argument("--dump", action="store_true", help="print the report saved in node_log.json")
+    mode.add_argument("--test", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--loop", type=float, metavar="SECS",
+        help="keep polling every SECS seconds in this process, reusing each node's session")
+    parser.add_argument("--from", dest="from_file", metavar="FILE",
+        help="read more nodes for --ip/--check from FILE ('-' for stdin), e.g. --examine output")
+    parser.add_argument("--workers", type=int, default=16, help="nodes handled at a time (default 16)")
+    parser.add_argument("--cache", action="store_true", help="reuse recent API results")
+    parser.add_argument("--cache-file", metavar="NAME", help="reuse recent API results saved in NAME")
+    parser.add_argument("--profile", metavar="NAME", help="sample where the run spends its time, collapsed stacks go to NAME")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.profile is not None:
+        from flux_profile import start_profile
+        start_profile(args.profile)
+    if args.cache or args.cache_file is not None:
+        from flux_cache import FluxCache
+        flux_cache = FluxCache(path=args.cache_file)
+        if args.cache_file is not None:
+            atexit.register(flux_cache.save)
+    if args.dump:
         dump_report()
         sys.exit(0)
-    if sys.argv[1].lower() == "--check":
-        if len(sys.argv) > 2:
-            node = sys.argv[2]
-            cdata = get_flux(node, "daemon/getzelnodestatus")
-            cstatus = cdata['status']
-            ctier = cdata['tier']
-            cdata = get_flux(node, "apps/listrunningapps")
-            capp_state = ""
-            for capp in cdata:
-                if capp["Names"][0] == "/fluxp1test_p1":
-                    capp_state += "Found " + capp["Names"][0]
-                    capp_state += " State " + capp["State"] + " Status " + capp["Status"] + " "
-                if capp["Names"][0] == "/fluxgammonbot_gammonbot":
-                    capp_state += "Found " + capp["Names"][0]
-                    capp_state += " State " + capp["State"] + " Status " + capp["Status"] + " "
-            print(node, cstatus, ctier,  capp_state)
-            sys.exit(0)
-    if sys.argv[1].lower() == "--test":
+    if args.test:
 #        data = get_flux("", "apps/location/gammonbot")
 #        print("gammonbot", data)
         tdata = get_flux("192.168.8.90:16177","daemon/getzelnodestatus")
@@ -222,7 +391,25 @@ if __name__ == "__main__":
         tdata = get_public_ip()
         print("IP = ", tdata)
         sys.exit(0)
-    print("Incorrect arguments:")
-    print("With no arguments all nodes running ", APP_NAME, " will be polled")
-    print("If you specify '--ip ipaddress' then that ipaddress will be polled")
-    sys.exit(1)
+    if args.ip is not None or args.check is not None:
+        try:
+            node_list = read_nodes(args.ip if args.ip is not None else args.check, args.from_file)
+        except OSError as error:
+            print("Error opening", error.filename)
+            sys.exit(1)
+        if len(node_list) == 0:
+            print("No nodes given, list them after the option or use --from FILE")
+            sys.exit(1)
+        errors = run_batch(vault_node if args.ip is not None else check_node, node_list, args.workers)
+        sys.exit(1 if errors > 0 else 0)
+    if args.loop is None:
+        node_vault()
+        sys.exit(0)
+    import time
+    while True:
+        try:
+            node_vault()
+        except Exception as error: # pylint: disable=W0703
+            # Keep the vault running, the next cycle may go better
+            print(logmsg("Poll cycle failed " + repr(error)))
+        time.sleep(args.loop)